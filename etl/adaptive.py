@@ -0,0 +1,59 @@
+"""Адаптивный размер пачек по схеме AIMD.
+
+Пока пачки укладываются в целевое время и объем, размер растет на шаг;
+при превышении или отказе Elastic (429) сразу уменьшается вдвое. Так
+пропускная способность держится у предела кластера без его перегрузки.
+"""
+from typing import Optional
+
+from metrics import Gauge
+from utils import logger
+
+
+class AIMDController:
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        step: int,
+        target_seconds: float,
+        target_bytes: Optional[int] = None,
+        decrease: float = 0.5,
+        gauge: Optional[Gauge] = None,
+    ):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.decrease = decrease
+        self.gauge = gauge
+        self.value = min(max(initial, minimum), maximum)
+        if gauge is not None:
+            gauge.set(self.value)
+
+    def overloaded(self, seconds: float, payload_bytes: int, rejected: int) -> bool:
+        if rejected or seconds > self.target_seconds:
+            return True
+        return bool(self.target_bytes) and payload_bytes > self.target_bytes
+
+    def observe(
+        self, seconds: float, payload_bytes: int = 0, rejected: int = 0
+    ) -> int:
+        """Учитывает одну пачку и возвращает размер для следующей."""
+        if self.overloaded(seconds, payload_bytes, rejected):
+            value = max(self.minimum, int(self.value * self.decrease))
+        else:
+            value = min(self.maximum, self.value + self.step)
+        if value != self.value:
+            logger.debug(
+                f"{self.name}: {self.value} -> {value} "
+                f"({seconds:.3f}s, {payload_bytes} bytes, {rejected} rejected)"
+            )
+        self.value = value
+        if self.gauge is not None:
+            self.gauge.set(value)
+        return value
@@ -0,0 +1,97 @@
+"""Синтетический каталог для бенчмарков ETL.
+
+Строки повторяют форму full_filmwork_data_sql_template (фильм x персона x
+жанр) или aggregated_filmwork_data_sql_template (одна строка на фильм).
+"""
+import datetime
+import random
+import uuid
+
+ROLES = ("actor", "writer", "director")
+TYPES = ("movie", "tv_show")
+
+
+class Catalogue:
+    def __init__(
+        self, films: int, cast: int, genres: int, people: int = 0, seed: int = 0
+    ):
+        self.films = films
+        self.cast = cast
+        self.genres = genres
+        rnd = random.Random(seed)
+        self.random = rnd
+        # Общий пул персон, чтобы люди снимались в нескольких фильмах.
+        self.people = [
+            (str(uuid.UUID(int=rnd.getrandbits(128))), f"Person {i}")
+            for i in range(people or max(cast * 10, 1))
+        ]
+        self.genre_names = [f"Genre {i}" for i in range(max(genres * 3, 1))]
+        self.created = datetime.datetime(2021, 6, 16, tzinfo=datetime.timezone.utc)
+
+    def film(self, number: int) -> dict:
+        rnd = self.random
+        return {
+            "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+            "title": f"Film {number}",
+            "description": "Synthetic description " * rnd.randint(1, 20),
+            "rating": round(rnd.uniform(1, 10), 1),
+            "type": rnd.choice(TYPES),
+            "created": self.created,
+            "modified": self.created + datetime.timedelta(seconds=number),
+        }
+
+    def credits(self) -> list[tuple[str, str, str]]:
+        """(роль, id, имя) без повторов персоны в одной роли."""
+        people = self.random.sample(self.people, min(self.cast, len(self.people)))
+        return [
+            (ROLES[i % len(ROLES)], person_id, name)
+            for i, (person_id, name) in enumerate(people)
+        ]
+
+    def join_rows(self) -> list[dict]:
+        rows = []
+        for number in range(self.films):
+            film = self.film(number)
+            genres = self.random.sample(self.genre_names, self.genres)
+            for role, person_id, name in self.credits():
+                for genre in genres:
+                    rows.append(
+                        {
+                            **film,
+                            "person_role": role,
+                            "person_id": person_id,
+                            "person_name": name,
+                            "genre_name": genre,
+                        }
+                    )
+        return rows
+
+    def aggregated_rows(self) -> list[dict]:
+        rows = []
+        for number in range(self.films):
+            film = self.film(number)
+            credits = self.credits()
+            rows.append(
+                {
+                    **film,
+                    "actors": [
+                        {"id": person_id, "name": name}
+                        for role, person_id, name in credits
+                        if role == "actor"
+                    ],
+                    "writers": [
+                        {"id": person_id, "name": name}
+                        for role, person_id, name in credits
+                        if role == "writer"
+                    ],
+                    "directors": [
+                        name for role, _, name in credits if role == "director"
+                    ],
+                    "genres": self.random.sample(self.genre_names, self.genres),
+                }
+            )
+        return rows
+
+
+def make_rows(films: int, cast: int, genres: int) -> list[dict]:
+    return Catalogue(films, cast, genres).join_rows()
@@ -0,0 +1,172 @@
+"""Бенчмарки стадий ETL без внешних сервисов.
+
+Каждая стадия меряется отдельно: свертка строк в Transformer, сборка
+bulk-документов, JSON-сериализация, вызовы State и сквозная загрузка в
+локальный фейковый _bulk. Результат печатается в JSON, чтобы сравнивать
+прогоны между собой.
+
+Запуск из каталога etl:
+    python -m benchmarks.run --films 2000 --cast 30 --output bench.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from benchmarks.catalogue import Catalogue
+from loader import ElasticAccessor, build_action
+from serializers import ElasticSerializer
+from state import JsonFileStorage, SQLiteStorage, State
+from transformer import Transformer
+
+
+def measure(name: str, func: Callable, items: int, unit: str) -> dict:
+    """Время лучшего из трех прогонов и пик памяти отдельным прогоном."""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "stage": name,
+        "items": items,
+        "seconds": round(best, 6),
+        f"{unit}_per_sec": round(items / best, 1) if best else None,
+        "peak_memory_bytes": peak,
+    }
+
+
+class FakeBulkHandler(BaseHTTPRequestHandler):
+    """Отвечает как Elasticsearch: все документы _bulk приняты."""
+
+    def _reply(self, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._reply(
+            {
+                "version": {"number": "7.17.0", "build_flavor": "default"},
+                "tagline": "You Know, for Search",
+            }
+        )
+
+    def do_HEAD(self):
+        self._reply({})
+
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers["Content-Length"])).splitlines()
+        items = [
+            {"index": {"_id": json.loads(line)["index"]["_id"], "status": 201}}
+            for line in lines[::2]
+        ]
+        self._reply({"took": 1, "errors": False, "items": items})
+
+    def log_message(self, *args):
+        pass
+
+
+def run(films: int, cast: int, genres: int) -> dict:
+    catalogue = Catalogue(films, cast, genres)
+    rows = catalogue.join_rows()
+    aggregated = catalogue.aggregated_rows()
+    filmworks = Transformer(rows).transform_for_es()
+    actions = [build_action(filmwork, "movies") for filmwork in filmworks]
+    serializer = ElasticSerializer()
+    results = [
+        measure(
+            "transform_join_rows",
+            lambda: Transformer(rows).transform_for_es(),
+            len(rows),
+            "rows",
+        ),
+        measure(
+            "transform_aggregated_rows",
+            lambda: Transformer(aggregated).transform_for_es(),
+            len(aggregated),
+            "rows",
+        ),
+        measure(
+            "gen_data",
+            lambda: [build_action(filmwork, "movies") for filmwork in filmworks],
+            len(filmworks),
+            "docs",
+        ),
+        measure(
+            "json_serialisation",
+            lambda: [serializer.dumps(action) for action in actions],
+            len(actions),
+            "docs",
+        ),
+    ]
+
+    checkpoints = 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, storage_cls in (("sqlite", SQLiteStorage), ("json", JsonFileStorage)):
+            state = State(storage_cls(os.path.join(tmp, f"state.{name}")))
+
+            def checkpoint_calls(state=state):
+                for i in range(checkpoints):
+                    state.set_state("person_checkpoint", {"id": str(i)})
+                    state.flush()
+                    state.get_state("person_checkpoint")
+
+            results.append(
+                measure(f"state_{name}", checkpoint_calls, checkpoints, "calls")
+            )
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBulkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        accessor = ElasticAccessor(
+            port=str(server.server_address[1]),
+            skip_unchanged=False,
+            check_index=False,
+        )
+        accessor.index_ready = True
+
+        def end_to_end():
+            accessor.push(Transformer(rows).transform_for_es())
+
+        results.append(measure("end_to_end_fake_bulk", end_to_end, films, "docs"))
+    finally:
+        server.shutdown()
+
+    return {
+        "params": {"films": films, "cast": cast, "genres": genres},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--films", type=int, default=1000)
+    parser.add_argument("--cast", type=int, default=30)
+    parser.add_argument("--genres", type=int, default=4)
+    parser.add_argument("--output", help="Файл для JSON-результата")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args.films, args.cast, args.genres), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
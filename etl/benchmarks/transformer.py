@@ -0,0 +1,31 @@
+"""Замер скорости Transformer на синтетических строках.
+
+Запуск из каталога etl: python -m benchmarks.transformer --films 2000 --cast 30
+"""
+import argparse
+import time
+
+from benchmarks.catalogue import make_rows
+from transformer import Transformer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--films", type=int, default=1000)
+    parser.add_argument("--cast", type=int, default=30)
+    parser.add_argument("--genres", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = make_rows(args.films, args.cast, args.genres)
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        Transformer(rows).transform_for_es()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{len(rows)} rows in {best:.3f}s: {len(rows) / best:,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    main()
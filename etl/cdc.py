@@ -0,0 +1,120 @@
+import select
+from collections import defaultdict
+from pathlib import Path
+from typing import Generator, Optional
+
+import psycopg2
+from extractor import ExtractEntity
+from sql_utils import drain_outbox_sql
+from utils import backoff, gen_backoff, logger
+
+OUTBOX_DDL_PATH = Path(__file__).resolve().parent / "db" / "change_outbox.ddl"
+
+
+class OutboxExtractor:
+    """Режим CDC: триггеры пишут изменения в content.change_outbox и шлют NOTIFY.
+
+    ETL ждет уведомления на LISTEN, а затем разбирает журнал пачками.
+    Записи журнала удаляются в той же транзакции, которая фиксируется
+    только после загрузки пачки, поэтому при сбое изменения не теряются.
+    """
+
+    def __init__(
+        self,
+        extractor: ExtractEntity,
+        channel: str = "content_changes",
+        batch_size: int = 500,
+    ):
+        self.extractor = extractor
+        self.channel = channel
+        self.batch_size = batch_size
+        self._listen_conn: Optional[psycopg2.extensions.connection] = None
+
+    @backoff()
+    def install(self):
+        """Создает журнал и триггеры; в режиме polling они не нужны."""
+        with self.extractor.pool.connection() as connection:
+            cursor = connection.cursor()
+            self.extractor.make_query(cursor, OUTBOX_DDL_PATH.read_text())
+        logger.info("Change outbox and triggers are installed")
+
+    @backoff()
+    def listen(self):
+        conn = psycopg2.connect(**self.extractor.conn_details)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel};")
+        self._listen_conn = conn
+        logger.info(f"Listening for changes on {self.channel}")
+
+    @backoff()
+    def wait_for_changes(self, timeout: float) -> bool:
+        """Блокируется до NOTIFY или таймаута.
+
+        Таймаут страхует от уведомлений, пропущенных при переподключении.
+        """
+        if self._listen_conn is None or self._listen_conn.closed:
+            # Пока соединения не было, уведомления могли потеряться.
+            self.listen()
+            return True
+        try:
+            ready, _, _ = select.select([self._listen_conn], [], [], timeout)
+            if ready:
+                self._listen_conn.poll()
+                self._listen_conn.notifies.clear()
+        except psycopg2.Error:
+            self._listen_conn.close()
+            raise
+        return bool(ready)
+
+    def last_change_id(self) -> int:
+        with self.extractor.pool.connection() as connection:
+            cursor = connection.cursor()
+            self.extractor.make_query(
+                cursor, "SELECT COALESCE(MAX(id), 0) FROM content.change_outbox;"
+            )
+            return cursor.fetchone()[0]
+
+    def discard_changes(self, up_to: int):
+        """Удаляет записи, которые уже покрыты полной загрузкой."""
+        with self.extractor.pool.connection() as connection:
+            cursor = connection.cursor()
+            self.extractor.make_query(
+                cursor,
+                "DELETE FROM content.change_outbox WHERE id <= %(up_to)s;",
+                {"up_to": up_to},
+            )
+
+    def changed_filmworks(self, cursor, changes: list[tuple]) -> list[str]:
+        by_entity = defaultdict(list)
+        for entity, entity_id in changes:
+            by_entity[entity].append(entity_id)
+        filmworks_ids = set()
+        for entity, ids in by_entity.items():
+            for batch in self.extractor.filmworks_to_rebuild(
+                cursor=cursor, entity_ids=iter([ids]), entity=entity
+            ):
+                filmworks_ids.update(batch)
+        return list(filmworks_ids)
+
+    @gen_backoff()
+    def extract_changes(self) -> Generator[list[dict], None, None]:
+        while True:
+            with self.extractor.pool.connection(autocommit=False) as connection:
+                cursor = connection.cursor()
+                self.extractor.make_query(
+                    cursor, drain_outbox_sql, {"limit": self.batch_size}
+                )
+                changes = cursor.fetchall()
+                if not changes:
+                    return
+                logger.info(f"{len(changes)} changes has been taken from outbox")
+                filmworks_ids = self.changed_filmworks(cursor, changes)
+                chunks = (
+                    filmworks_ids[i:i + self.batch_size]
+                    for i in range(0, len(filmworks_ids), self.batch_size)
+                )
+                yield from self.extractor.get_full_filmwork_data_for_es(
+                    cursor=cursor, filmworks_ids=chunks, where=True
+                )
+                connection.commit()
@@ -0,0 +1,54 @@
+from typing import Literal, Optional
+
+from pydantic import BaseSettings
+
+
+class ETLSettings(BaseSettings):
+    """Настройки ETL, переопределяются переменными окружения с префиксом ETL_."""
+
+    state_storage: Literal["redis", "redis_hash", "sqlite", "json"] = "redis"
+    state_path: Optional[str] = None
+    redis_host: str = "localhost"
+    full_load_itersize: int = 2000
+    aggregate_in_postgres: bool = False
+    pg_pool_minconn: int = 1
+    pg_pool_maxconn: int = 4
+    pg_health_check_interval: float = 30
+    bulk_mode: Literal["bulk", "streaming", "parallel"] = "streaming"
+    bulk_chunk_size: int = 500
+    bulk_max_chunk_bytes: int = 100 * 1024 * 1024
+    bulk_thread_count: int = 4
+    bulk_max_retries: int = 3
+    bulk_retry_sleep: float = 0.5
+    skip_unchanged: bool = False
+    fingerprints_path: str = "etl_fingerprints.sqlite3"
+    es_replicas: int = 1
+    pipeline: bool = False
+    coalesce_entities: bool = False
+    coalesce_max_filmworks: int = 10000
+    coalesce_chunk_size: int = 500
+    change_capture: Literal["polling", "outbox"] = "polling"
+    outbox_batch_size: int = 500
+    outbox_wait_timeout: float = 30
+    transform_workers: int = 1
+    transform_pool_min_rows: int = 5000
+    pipeline_queue_size: int = 2
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9108
+    partial_updates: bool = False
+    adaptive_batches: bool = False
+    adaptive_page_seconds: float = 2.0
+    adaptive_page_min: int = 10
+    adaptive_page_max: int = 5000
+    adaptive_page_step: int = 50
+    adaptive_bulk_seconds: float = 1.0
+    adaptive_bulk_bytes: int = 5 * 1024 * 1024
+    adaptive_bulk_min: int = 10
+    adaptive_bulk_max: int = 5000
+    adaptive_bulk_step: int = 50
+
+    class Config:
+        env_prefix = "ETL_"
+
+
+settings = ETLSettings()
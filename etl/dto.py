@@ -1,5 +1,5 @@
 import datetime
-from dataclasses import asdict, dataclass, fields
+from dataclasses import dataclass, fields
 
 from pydantic import BaseModel
 
@@ -23,13 +23,16 @@ class FilmWork:
         return [field.name for field in fields(cls)]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Person:
     id: str
     name: str
 
+    def as_dict(self) -> dict:
+        return {"id": self.id, "name": self.name}
 
-@dataclass
+
+@dataclass(slots=True)
 class EnrichedFilmWork:
     id: str
     title: str
@@ -43,13 +46,13 @@ class EnrichedFilmWork:
     actors_names: list[str]
     writers: list[Person]
     writers_names: list[str]
-    genre: str
+    genre: list[str]
 
     def get_actors(self):
-        return [asdict(actor) for actor in self.actors]
+        return [actor.as_dict() for actor in self.actors]
 
     def get_writers(self):
-        return [asdict(writer) for writer in self.writers]
+        return [writer.as_dict() for writer in self.writers]
 
     def get_actors_names(self):
         return ",".join(self.actors_names)
@@ -0,0 +1,124 @@
+"""Проверка планов запросов ETL к Postgres.
+
+Для каждого частого запроса Extractor выполняется EXPLAIN с
+enable_seqscan = off, чтобы и на небольшой базе планировщик выбирал
+индексы. Запрос не проходит проверку, если в плане остался Seq Scan или
+не используется ожидаемый индекс: без нужного индекса Postgres может
+обойтись полным просмотром другого индекса по неведущей колонке, и
+отсутствие Seq Scan этого не выявит. Полная начальная загрузка читает
+таблицы целиком и не проверяется.
+
+Запуск из каталога etl на базе с данными: python explain_check.py
+"""
+import datetime
+import sys
+import uuid
+from typing import Iterator, Optional
+
+import psycopg2
+from extractor import Extractor
+from sql_utils import (
+    ZERO_UUID,
+    aggregated_filmwork_data_sql_template,
+    drain_outbox_sql,
+    full_filmwork_data_sql_template,
+    modified_entities_sql_template,
+    modified_filmworks_sql_template,
+    person_roles_sql,
+)
+
+ENTITIES = ("film_work", "person", "genre")
+
+
+def sample_ids(cursor, table: str, limit: int = 100) -> list[str]:
+    cursor.execute(f"SELECT id::text FROM content.{table} LIMIT {limit};")
+    ids = [row[0] for row in cursor.fetchall()]
+    return ids or [str(uuid.uuid4()) for _ in range(limit)]
+
+
+def hot_queries(cursor) -> dict[str, tuple[str, Optional[dict], set[str]]]:
+    """Запросы в том виде, в каком их строит Extractor, и нужные им индексы."""
+    queries = {}
+    checkpoint = {"modified": datetime.datetime.now(), "id": ZERO_UUID}
+    for entity in ENTITIES:
+        queries[f"modified {entity}"] = (
+            modified_entities_sql_template % {"entity": entity, "lim": "LIMIT 100"},
+            checkpoint,
+            {f"{entity}_modified_id_idx"},
+        )
+    for entity in ("person", "genre"):
+        ids = ",".join(f"'{id}'" for id in sample_ids(cursor, entity))
+        queries[f"film_work by {entity}"] = (
+            modified_filmworks_sql_template
+            % {"entity": entity, "ids": ids, "lim": ""},
+            None,
+            {f"{entity}_film_work_id_idx"},
+        )
+    where = "WHERE fw.id IN ({})".format(
+        ",".join(f"'{id}'" for id in sample_ids(cursor, "film_work"))
+    )
+    for name, template in (
+        ("full film_work data", full_filmwork_data_sql_template),
+        ("aggregated film_work data", aggregated_filmwork_data_sql_template),
+    ):
+        queries[name] = (
+            template % {"where": where, "lim": ""},
+            None,
+            {
+                "person_film_work_film_work_id_idx",
+                "genre_film_work_film_work_id_idx",
+            },
+        )
+    queries["person roles"] = (
+        person_roles_sql,
+        {"ids": sample_ids(cursor, "person")},
+        {"person_film_work_id_idx"},
+    )
+    # Журнал есть только в режиме outbox.
+    cursor.execute("SELECT to_regclass('content.change_outbox');")
+    if cursor.fetchone()[0] is not None:
+        queries["drain outbox"] = (
+            drain_outbox_sql,
+            {"limit": 500},
+            {"change_outbox_pkey"},
+        )
+    return queries
+
+
+def plan_nodes(plan: dict) -> Iterator[dict]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def plan_problems(plan: dict, expected_indexes: set[str]) -> list[str]:
+    nodes = list(plan_nodes(plan))
+    problems = [
+        f"Seq Scan on {node.get('Relation Name', '?')}"
+        for node in nodes
+        if node.get("Node Type") == "Seq Scan"
+    ]
+    used = {node["Index Name"] for node in nodes if "Index Name" in node}
+    problems += [f"{index} not used" for index in sorted(expected_indexes - used)]
+    return problems
+
+
+def check(conn_details: dict) -> list[str]:
+    failures = []
+    with psycopg2.connect(**conn_details) as conn, conn.cursor() as cursor:
+        cursor.execute("SET enable_seqscan = off;")
+        for name, (sql, params, indexes) in hot_queries(cursor).items():
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            problems = plan_problems(cursor.fetchone()[0][0]["Plan"], indexes)
+            print(f"{name}: {'; '.join(problems) or 'ok'}")
+            if problems:
+                failures.append(name)
+        conn.rollback()
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check(Extractor().conn_details)
+    if failures:
+        print(f"Queries without the expected index plan: {', '.join(failures)}")
+        sys.exit(1)
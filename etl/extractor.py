@@ -1,12 +1,22 @@
 import contextlib
 import datetime
+import time
 from typing import Generator, Literal, Optional
 from uuid import uuid4
 
+import metrics
 import psycopg2
+from config import settings
 from dto import FilmWork
-from psycopg2.extensions import cursor
-from sql_utils import full_filmwork_data_sql_template
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, cursor
+from psycopg2.pool import ThreadedConnectionPool
+from sql_utils import (
+    ZERO_UUID,
+    aggregated_filmwork_data_sql_template,
+    full_filmwork_data_sql_template,
+    modified_entities_sql_template,
+    modified_filmworks_sql_template,
+)
 from state import state
 from utils import gen_backoff, logger
 
@@ -22,6 +32,85 @@ def psql_conn_context(
     conn.close()
 
 
+class PostgresPool:
+    """Пул долгоживущих соединений с проверкой живости и переподключением.
+
+    Сломанное соединение выбрасывается из пула, а OperationalError
+    пробрасывается дальше, чтобы gen_backoff перезапустил извлечение.
+    """
+
+    def __init__(
+        self,
+        minconn: int = 1,
+        maxconn: int = 4,
+        health_check_interval: float = 30,
+        **conn_details,
+    ):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_interval = health_check_interval
+        self.conn_details = conn_details
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._last_used: dict[int, float] = {}
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        if self._pool is None or self._pool.closed:
+            self._pool = ThreadedConnectionPool(
+                self.minconn, self.maxconn, **self.conn_details
+            )
+        return self._pool
+
+    def _is_alive(self, conn: psycopg2.extensions.connection) -> bool:
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn), 0)
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def _release(self, conn: psycopg2.extensions.connection, broken: bool):
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        close = broken or bool(conn.closed)
+        if close:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn, close=close)
+
+    @contextlib.contextmanager
+    def connection(self, autocommit: bool = True):
+        pool = self._get_pool()
+        conn = pool.getconn()
+        if not self._is_alive(conn):
+            logger.info("Dropping dead Postgres connection from pool")
+            self._release(conn, broken=True)
+            conn = pool.getconn()
+        conn.autocommit = autocommit
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+
+
 class Extractor:
     """Get data from source."""
 
@@ -32,6 +121,7 @@ class Extractor:
         dbname="movies_database",
         user="app",
         password="123qwe",
+        aggregate_in_postgres: Optional[bool] = None,
     ):
         self.conn_details = {
             "host": host,
@@ -40,10 +130,45 @@ class Extractor:
             "user": user,
             "password": password,
         }
+        self.pool = PostgresPool(
+            minconn=settings.pg_pool_minconn,
+            maxconn=settings.pg_pool_maxconn,
+            health_check_interval=settings.pg_health_check_interval,
+            **self.conn_details,
+        )
+        self.defer_checkpoints = False
+        self.page_checkpoints: dict[str, dict] = {}
+        # PersonPartialUpdater, если включены частичные обновления.
+        self.partial_updater = None
+        # AIMDController страниц изменений и полной загрузки; current — тот,
+        # что выдал последнюю пачку, его подстраивает загрузка.
+        self.page_size = None
+        self.full_load_size = None
+        self.current_page_size = None
+        if aggregate_in_postgres is None:
+            aggregate_in_postgres = settings.aggregate_in_postgres
+        # Агрегирующий запрос отдает одну готовую строку на фильм.
+        self.filmwork_data_sql_template = (
+            aggregated_filmwork_data_sql_template
+            if aggregate_in_postgres
+            else full_filmwork_data_sql_template
+        )
 
     # @backoff()
-    def make_query(self, cursor: cursor, sql: str):
-        return cursor.execute(sql)
+    def make_query(self, cursor: cursor, sql: str, params: Optional[dict] = None):
+        with metrics.extract_query_seconds.time():
+            return cursor.execute(sql, params)
+
+    def get_checkpoint(self, entity: str) -> dict:
+        """Позиция (modified, id), после которой ищутся изменения сущности."""
+        checkpoint = state.get_state(f"{entity}_checkpoint")
+        if checkpoint is None:
+            checkpoint = {"modified": state.get_state("time_of_run"), "id": ZERO_UUID}
+        return checkpoint
+
+    def save_checkpoint(self, entity: str, checkpoint: dict) -> None:
+        state.set_state(f"{entity}_checkpoint", checkpoint)
+        state.flush()
 
     def extract_modified_entities(
         self,
@@ -52,42 +177,40 @@ class Extractor:
         limit: Optional[str] = None,
         time_of_run: Optional[datetime.datetime] = None,
     ) -> Generator[list[str], None, None]:
-        while True:
-            excepted_ids = state.get_state(f"{entity}_excepted_ids")
-            if not time_of_run:
-                time_of_run = state.get_state("time_of_run")
+        """Постранично отдает id изменившихся записей по ключу (modified, id).
 
-            entities_ids = []
+        Чекпоинт страницы сохраняется после того, как потребитель обработал ее.
+        При defer_checkpoints он только запоминается в page_checkpoints,
+        а сохраняет его тот, кто подтвердил загрузку.
+        """
+        checkpoint = (
+            {"modified": time_of_run, "id": ZERO_UUID}
+            if time_of_run
+            else self.get_checkpoint(entity)
+        )
+        self.page_checkpoints.pop(entity, None)
+        while True:
+            if limit and self.page_size is not None:
+                # Размер страницы пересчитывается перед каждым запросом.
+                limit = self.page_size.value
+                self.current_page_size = self.page_size
             lim = f"LIMIT {limit}" if limit else ""
-            where = (
-                f"""and id NOT IN ({','.join([f"'{id}'" for id in excepted_ids])})"""
-                if excepted_ids
-                else ""
-            )
-            sql = f"""
-                SELECT id, modified
-                FROM content.{entity}
-                WHERE modified > '{time_of_run}' {where}
-                ORDER BY modified
-                {lim};
-            """
-            self.make_query(cursor, sql)
+            sql = modified_entities_sql_template % {"entity": entity, "lim": lim}
+            self.make_query(cursor, sql, checkpoint)
             entity_data = cursor.fetchall()
             if not entity_data:
                 logger.debug("Stop iteration in extract_modified_entities")
                 return
+            last_id, last_modified = entity_data[-1]
+            checkpoint = {"modified": last_modified, "id": last_id}
+            self.page_checkpoints[entity] = checkpoint
             entities_ids = [row[0] for row in entity_data]
-
-            ei = state.get_state(f"{entity}_excepted_ids")
-            state.set_state(
-                f"{entity}_excepted_ids",
-                [*entities_ids] if not ei else [*ei, *entities_ids],
-            )
-            if entities_ids:
-                logger.info(
-                    f"{len(entities_ids)} rows has been extracted, {entity}!"
-                )
+            logger.info(f"{len(entities_ids)} rows has been extracted, {entity}!")
             yield entities_ids
+            if not self.defer_checkpoints:
+                self.save_checkpoint(entity, checkpoint)
+            if not limit:
+                return
 
     def extract_modified_filmworks(
         self,
@@ -99,20 +222,18 @@ class Extractor:
         for batch in entity_ids:
             if entity == "film_work":
                 yield batch
+                continue
             lim = f"LIMIT {limit}" if limit else ""
 
-            sql = f"""
-                SELECT fw.id, fw.modified
-                FROM content.film_work fw
-                LEFT JOIN content.{entity}_film_work pfw ON pfw.film_work_id = fw.id
-                WHERE pfw.{entity}_id IN ({','.join([f"'{id}'" for id in batch])})
-                ORDER BY fw.modified
-                {lim};
-            """
+            sql = modified_filmworks_sql_template % {
+                "entity": entity,
+                "ids": ",".join([f"'{id}'" for id in batch]),
+                "lim": lim,
+            }
             self.make_query(cursor, sql)
             filmworks = cursor.fetchall()
             if not filmworks:
-                return
+                continue
             filmworks_ids = [row[0] for row in filmworks]
 
             logger.info(
@@ -121,6 +242,21 @@ class Extractor:
             )
             yield filmworks_ids
 
+    def filmworks_to_rebuild(
+        self,
+        cursor: cursor,
+        entity_ids: Generator[list[uuid4], None, None],
+        entity: str,
+    ) -> Generator[list[str], None, None]:
+        """Фильмы для полной переиндексации; имена персон — частичным обновлением."""
+        if entity == "person" and self.partial_updater is not None:
+            return self.partial_updater.filmworks_to_rebuild(
+                cursor=cursor, entity_ids=entity_ids
+            )
+        return self.extract_modified_filmworks(
+            cursor=cursor, entity_ids=entity_ids, entity=entity
+        )
+
     def get_full_filmwork_data_for_es(
         self,
         cursor: cursor,
@@ -136,16 +272,13 @@ class Extractor:
                 if where
                 else ""
             )
-            sql = full_filmwork_data_sql_template % {
-                "lim": lim,
-                "where": where,
-            }
+            sql = self.filmwork_data_sql_template % {"lim": lim, "where": where}
 
             self.make_query(cursor, sql)
             meta = cursor.description
             fullfilled_fws = cursor.fetchall()
             if not fullfilled_fws:
-                raise StopIteration()
+                continue
             fullfilled_fws = [
                 dict(zip([col.name for col in meta], row))
                 for row in fullfilled_fws
@@ -155,6 +288,49 @@ class Extractor:
             )
             yield fullfilled_fws
 
+    def stream_full_filmwork_data_for_es(
+        self,
+        connection: psycopg2.extensions.connection,
+        itersize: int,
+    ) -> Generator[list[dict], None, None]:
+        """Читает всю выборку серверным курсором пачками примерно по itersize.
+
+        Строки одного фильма никогда не делятся между пачками.
+        """
+        sql = self.filmwork_data_sql_template % {"lim": "", "where": ""}
+        with connection.cursor(name="full_filmwork_data") as cursor:
+            cursor.itersize = itersize
+            # execute у серверного курсора ленивый: запрос выполняется при
+            # чтении, поэтому в гистограмму идет время каждого fetchmany.
+            cursor.execute(sql)
+            columns = None
+            batch = []
+            while rows := self.fetch_page(cursor, self.full_load_rows(itersize)):
+                if columns is None:
+                    columns = [col.name for col in cursor.description]
+                batch.extend(dict(zip(columns, row)) for row in rows)
+                last_id = batch[-1]["id"]
+                split = len(batch)
+                while split and batch[split - 1]["id"] == last_id:
+                    split -= 1
+                if split:
+                    logger.info(f"{split} rows has been streamed, full_film_work!")
+                    yield batch[:split]
+                    batch = batch[split:]
+            if batch:
+                logger.info(f"{len(batch)} rows has been streamed, full_film_work!")
+                yield batch
+
+    def fetch_page(self, cursor: cursor, size: int) -> list[tuple]:
+        with metrics.extract_query_seconds.time():
+            return cursor.fetchmany(size)
+
+    def full_load_rows(self, itersize: int) -> int:
+        if self.full_load_size is None:
+            return itersize
+        self.current_page_size = self.full_load_size
+        return self.full_load_size.value
+
     def extract(self, time_of_run: datetime.datetime) -> list[FilmWork]:
         with psql_conn_context(**self.conn_details) as connection:
             cursor = connection.cursor()
@@ -171,17 +347,19 @@ class ExtractEntity(Extractor):
     def extract(
         self,
         entity: Literal["genre", "person", "film_work"],
+        since: Optional[datetime.datetime] = None,
     ) -> Generator[list[FilmWork], None, None]:
 
-        with psql_conn_context(**self.conn_details) as connection:
+        with self.pool.connection() as connection:
             cursor = connection.cursor()
 
             entities_ids_gen = self.extract_modified_entities(
                 cursor=cursor,
                 entity=entity,
                 limit="100",
+                time_of_run=since,
             )
-            filmworks_gen = self.extract_modified_filmworks(
+            filmworks_gen = self.filmworks_to_rebuild(
                 cursor=cursor, entity_ids=entities_ids_gen, entity=entity
             )
             fullfilled_filmworks_gen = self.get_full_filmwork_data_for_es(
@@ -190,24 +368,89 @@ class ExtractEntity(Extractor):
             for batch in fullfilled_filmworks_gen:
                 yield batch
 
+    def extract_checkpointed(
+        self, entities: list[str]
+    ) -> Generator[tuple[str, Optional[dict], list[FilmWork]], None, None]:
+        """Отдает пачки вместе с чекпоинтом, который сохранит потребитель.
+
+        Последней для каждой сущности идет пустая пачка с итоговым чекпоинтом.
+        """
+        self.defer_checkpoints = True
+        try:
+            for entity in entities:
+                for batch in self.extract(entity=entity):
+                    yield entity, self.page_checkpoints.get(entity), batch
+                yield entity, self.page_checkpoints.get(entity), []
+        finally:
+            self.defer_checkpoints = False
+
     @gen_backoff()
-    def extract_only_fw(self) -> Generator[list[FilmWork], None, None]:
-        with psql_conn_context(**self.conn_details) as connection:
-            cursor = connection.cursor()
-            entities_ids_gen = self.extract_modified_entities(
-                cursor=cursor,
-                entity="film_work",
-                limit=None,
-                time_of_run=datetime.datetime.min,
-            )
-            filmworks_gen = self.extract_modified_filmworks(
-                cursor=cursor, entity_ids=entities_ids_gen, entity="film_work"
-            )
-            fullfilled_filmworks_gen = self.get_full_filmwork_data_for_es(
-                cursor=cursor, filmworks_ids=filmworks_gen, where=False
+    def extract_coalesced(
+        self,
+        entities: list[str],
+        max_filmworks: int = 10000,
+        chunk_size: int = 500,
+    ) -> Generator[list[FilmWork], None, None]:
+        """Извлекает каждый измененный фильм один раз за цикл.
+
+        Id фильмов, задетых через любую сущность, собираются в одно множество,
+        и полный запрос выполняется по нему чанками. Чекпоинты сущностей
+        сохраняются только после загрузки всего собранного множества.
+        """
+        self.defer_checkpoints = True
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                filmworks_ids, reached = set(), {}
+                for entity in entities:
+                    entities_ids_gen = self.extract_modified_entities(
+                        cursor=cursor, entity=entity, limit="100"
+                    )
+                    for batch in self.filmworks_to_rebuild(
+                        cursor=cursor, entity_ids=entities_ids_gen, entity=entity
+                    ):
+                        filmworks_ids.update(batch)
+                        reached[entity] = self.page_checkpoints[entity]
+                        if len(filmworks_ids) >= max_filmworks:
+                            yield from self._extract_collected(
+                                cursor, filmworks_ids, reached, chunk_size
+                            )
+                    # Страницы без фильмов тоже сдвигают чекпоинт.
+                    if entity in self.page_checkpoints:
+                        reached[entity] = self.page_checkpoints[entity]
+                yield from self._extract_collected(
+                    cursor, filmworks_ids, reached, chunk_size
+                )
+        finally:
+            self.defer_checkpoints = False
+
+    def _extract_collected(
+        self,
+        cursor: cursor,
+        filmworks_ids: set,
+        reached: dict[str, dict],
+        chunk_size: int,
+    ) -> Generator[list[FilmWork], None, None]:
+        ids = list(filmworks_ids)
+        logger.info(f"{len(ids)} unique film_work collected across entities")
+        chunks = (ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size))
+        yield from self.get_full_filmwork_data_for_es(
+            cursor=cursor, filmworks_ids=chunks, where=True
+        )
+        for entity, checkpoint in reached.items():
+            self.save_checkpoint(entity, checkpoint)
+        filmworks_ids.clear()
+        reached.clear()
+
+    @gen_backoff()
+    def extract_only_fw(
+        self, itersize: Optional[int] = None
+    ) -> Generator[list[FilmWork], None, None]:
+        # Серверному курсору нужна транзакция.
+        with self.pool.connection(autocommit=False) as connection:
+            yield from self.stream_full_filmwork_data_for_es(
+                connection, itersize or settings.full_load_itersize
             )
-            for batch in fullfilled_filmworks_gen:
-                yield batch
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import hashlib
+import sqlite3
+import threading
+from typing import Iterable, Iterator, Optional
+
+import serializers
+from utils import logger
+
+
+def fingerprint(action: dict) -> bytes:
+    """Стабильный хэш документа; имя индекса в него не входит."""
+    body = {key: value for key, value in action.items() if key != "_index"}
+    encoded = serializers.dumps_bytes(body, sort_keys=True)
+    return hashlib.blake2b(encoded, digest_size=16).digest()
+
+
+class FingerprintStore:
+    """Хэши последних проиндексированных документов в локальной SQLite-базе.
+
+    Документ, хэш которого совпал с сохраненным, не отправляется в Elastic.
+    Хэш сохраняется только после того, как Elastic подтвердил документ.
+    """
+
+    def __init__(self, path: str = "etl_fingerprints.sqlite3"):
+        self.path = path
+        self.skipped = 0
+        self.sent = 0
+        self._pending: dict[str, bytes] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints "
+                "(id TEXT PRIMARY KEY, digest BLOB NOT NULL) WITHOUT ROWID"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _stored(self, doc_id: str) -> Optional[bytes]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT digest FROM fingerprints WHERE id = ?", (doc_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def changed(self, actions: Iterable[dict]) -> Iterator[dict]:
+        """Пропускает дальше только документы, которые изменились."""
+        for action in actions:
+            doc_id = str(action["_id"])
+            digest = fingerprint(action)
+            if self._stored(doc_id) == digest:
+                self.skipped += 1
+                continue
+            self._pending[doc_id] = digest
+            self.sent += 1
+            yield action
+
+    def confirm(self, doc_ids: Optional[Iterable[str]] = None):
+        """Запоминает хэши подтвержденных документов; None значит все."""
+        pending, self._pending = self._pending, {}
+        if doc_ids is not None:
+            pending = {
+                str(doc_id): pending[str(doc_id)]
+                for doc_id in doc_ids
+                if str(doc_id) in pending
+            }
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO fingerprints (id, digest) VALUES (?, ?)",
+                pending.items(),
+            )
+
+    def forget(self, doc_ids: Iterable[str]):
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM fingerprints WHERE id = ?",
+                ((str(doc_id),) for doc_id in doc_ids),
+            )
+
+    def clear(self):
+        """Сбрасывает все хэши, например после пересоздания индекса."""
+        logger.info("Fingerprints cleared")
+        self._pending = {}
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM fingerprints")
@@ -1,11 +1,148 @@
 import abc
+from time import perf_counter, sleep
+from typing import Iterable, Optional
 
+import metrics
 import requests
+from adaptive import AIMDController
+from config import settings
 from dto import ConnectionDetails, EnrichedFilmWork
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch import (
+    Elasticsearch,
+    ElasticsearchException,
+    NotFoundError,
+)
+from elasticsearch.helpers import (
+    BulkIndexError,
+    bulk,
+    parallel_bulk,
+    streaming_bulk,
+)
+from fingerprints import FingerprintStore
+from serializers import ElasticSerializer
 from utils import backoff, logger
 
+# Меняет имена персон во вложенных actors/writers и пересобирает строки
+# actors_names/writers_names. Документ без изменений помечается как noop.
+RENAME_PERSONS_SCRIPT = """
+boolean changed = false;
+for (String field : ['actors', 'writers']) {
+    if (ctx._source[field] == null) {
+        continue;
+    }
+    List names = new ArrayList();
+    for (def person : ctx._source[field]) {
+        String name = params.names[person.id];
+        if (name != null && name != person.name) {
+            person.name = name;
+            changed = true;
+        }
+        names.add(person.name);
+    }
+    ctx._source[field + '_names'] = String.join(',', names);
+}
+if (!changed) {
+    ctx.op = 'noop';
+}
+"""
+
+# Статусы, при которых документ имеет смысл отправить повторно.
+RETRYABLE_STATUSES = {404, 429, 500, 502, 503, 504, "N/A"}
+
+MOVIES_INDEX_BODY = {
+    "settings": {
+        "refresh_interval": "1s",
+        "analysis": {
+            "filter": {
+                "english_stop": {
+                    "type": "stop",
+                    "stopwords": "_english_",
+                },
+                "english_stemmer": {
+                    "type": "stemmer",
+                    "language": "english",
+                },
+                "english_possessive_stemmer": {
+                    "type": "stemmer",
+                    "language": "possessive_english",
+                },
+                "russian_stop": {
+                    "type": "stop",
+                    "stopwords": "_russian_",
+                },
+                "russian_stemmer": {
+                    "type": "stemmer",
+                    "language": "russian",
+                },
+            },
+            "analyzer": {
+                "ru_en": {
+                    "tokenizer": "standard",
+                    "filter": [
+                        "lowercase",
+                        "english_stop",
+                        "english_stemmer",
+                        "english_possessive_stemmer",
+                        "russian_stop",
+                        "russian_stemmer",
+                    ],
+                }
+            },
+        },
+    },
+    "mappings": {
+        "dynamic": "strict",
+        "properties": {
+            "id": {"type": "keyword"},
+            "imdb_rating": {"type": "float"},
+            "genre": {"type": "keyword"},
+            "title": {
+                "type": "text",
+                "analyzer": "ru_en",
+                "fields": {"raw": {"type": "keyword"}},
+            },
+            "description": {"type": "text", "analyzer": "ru_en"},
+            "director": {"type": "text", "analyzer": "ru_en"},
+            "actors_names": {"type": "text", "analyzer": "ru_en"},
+            "writers_names": {"type": "text", "analyzer": "ru_en"},
+            "actors": {
+                "type": "nested",
+                "dynamic": "strict",
+                "properties": {
+                    "id": {"type": "keyword"},
+                    "name": {"type": "text", "analyzer": "ru_en"},
+                },
+            },
+            "writers": {
+                "type": "nested",
+                "dynamic": "strict",
+                "properties": {
+                    "id": {"type": "keyword"},
+                    "name": {"type": "text", "analyzer": "ru_en"},
+                },
+            },
+        },
+    },
+}
+
+
+def build_action(filmwork: EnrichedFilmWork, index: str) -> dict:
+    """Документ для bulk-запроса; функция модуля, чтобы работать в процессах."""
+    return {
+        "_index": index,
+        "_id": filmwork.id,
+        "actors": [*filmwork.get_actors()],
+        "actors_names": filmwork.get_actors_names(),
+        "description": filmwork.description,
+        "director": filmwork.director,
+        "genre": filmwork.genre,
+        "id": filmwork.id,
+        "imdb_rating": filmwork.imdb_rating,
+        "title": filmwork.title,
+        "writers": [*filmwork.get_writers()],
+        "writers_names": filmwork.get_writers_names(),
+    }
+
 
 class IDataAccessor(abc.ABC):
     @abc.abstractmethod
@@ -19,123 +156,302 @@ class ElasticAccessor(IDataAccessor):
         base_url: str = "http://127.0.0.1",
         port: str = "9200",
         index: str = "movies",
+        bulk_mode: Optional[str] = None,
+        fingerprints: Optional[FingerprintStore] = None,
+        skip_unchanged: Optional[bool] = None,
+        check_index: bool = True,
     ):
         self.base_url = base_url
         self.port = port
         self.index = index
-        self.elastic = Elasticsearch(hosts=[f"{base_url}:{port}"])
+        self.bulk_mode = bulk_mode or settings.bulk_mode
+        if skip_unchanged is None:
+            skip_unchanged = settings.skip_unchanged
+        if fingerprints is None and skip_unchanged:
+            fingerprints = FingerprintStore(settings.fingerprints_path)
+        self.fingerprints = fingerprints
+        self.serializer = ElasticSerializer()
+        self.elastic = Elasticsearch(
+            hosts=[f"{base_url}:{port}"], serializer=self.serializer
+        )
+        self.chunk_size = (
+            AIMDController(
+                "bulk chunk size",
+                initial=settings.bulk_chunk_size,
+                minimum=settings.adaptive_bulk_min,
+                maximum=settings.adaptive_bulk_max,
+                step=settings.adaptive_bulk_step,
+                target_seconds=settings.adaptive_bulk_seconds,
+                target_bytes=settings.adaptive_bulk_bytes,
+                gauge=metrics.bulk_chunk_size,
+            )
+            if settings.adaptive_batches
+            else None
+        )
+        # Ответы 429 за последнюю загрузку, по ним сжимается и страница.
+        self.throttled = 0
         self.bulk_endpoint = "/_bulk"
         self.single_endpoint = f"/{self.index}/_doc/"
-        self._post_init()
+        self.index_ready = False
+        if check_index:
+            self._post_init()
 
     @backoff()
     def if_index_not_exist(self):
-        request_body = {
-            "settings": {
-                "refresh_interval": "1s",
-                "analysis": {
-                    "filter": {
-                        "english_stop": {
-                            "type": "stop",
-                            "stopwords": "_english_",
-                        },
-                        "english_stemmer": {
-                            "type": "stemmer",
-                            "language": "english",
-                        },
-                        "english_possessive_stemmer": {
-                            "type": "stemmer",
-                            "language": "possessive_english",
-                        },
-                        "russian_stop": {
-                            "type": "stop",
-                            "stopwords": "_russian_",
-                        },
-                        "russian_stemmer": {
-                            "type": "stemmer",
-                            "language": "russian",
-                        },
-                    },
-                    "analyzer": {
-                        "ru_en": {
-                            "tokenizer": "standard",
-                            "filter": [
-                                "lowercase",
-                                "english_stop",
-                                "english_stemmer",
-                                "english_possessive_stemmer",
-                                "russian_stop",
-                                "russian_stemmer",
-                            ],
-                        }
-                    },
-                },
-            },
-            "mappings": {
-                "dynamic": "strict",
-                "properties": {
-                    "id": {"type": "keyword"},
-                    "imdb_rating": {"type": "float"},
-                    "genre": {"type": "keyword"},
-                    "title": {
-                        "type": "text",
-                        "analyzer": "ru_en",
-                        "fields": {"raw": {"type": "keyword"}},
-                    },
-                    "description": {"type": "text", "analyzer": "ru_en"},
-                    "director": {"type": "text", "analyzer": "ru_en"},
-                    "actors_names": {"type": "text", "analyzer": "ru_en"},
-                    "writers_names": {"type": "text", "analyzer": "ru_en"},
-                    "actors": {
-                        "type": "nested",
-                        "dynamic": "strict",
-                        "properties": {
-                            "id": {"type": "keyword"},
-                            "name": {"type": "text", "analyzer": "ru_en"},
-                        },
-                    },
-                    "writers": {
-                        "type": "nested",
-                        "dynamic": "strict",
-                        "properties": {
-                            "id": {"type": "keyword"},
-                            "name": {"type": "text", "analyzer": "ru_en"},
-                        },
-                    },
-                },
-            },
-        }
         if not self.elastic.indices.exists(index=self.index):
             logger.info("Index didn't exist. Creating 'movies'...")
-            self.elastic.indices.create(index=self.index, body=request_body)
+            self.elastic.indices.create(index=self.index, body=MOVIES_INDEX_BODY)
+            if self.fingerprints is not None:
+                self.fingerprints.clear()
             logger.info(f"Index {self.index} succesfully created!")
 
-    def gen_data(self, filmworks: list[EnrichedFilmWork]):
+    def ensure_index(self):
+        """Проверяет индекс один раз, повторно только после ответа 404."""
+        if not self.index_ready:
+            self.if_index_not_exist()
+            self.index_ready = True
+
+    @staticmethod
+    def is_index_missing(error: Exception) -> bool:
+        if isinstance(error, NotFoundError):
+            return True
+        if isinstance(error, BulkIndexError):
+            return any(
+                item.get("status") == 404
+                for result in error.errors
+                for item in result.values()
+            )
+        return False
+
+    def build_action(self, filmwork: EnrichedFilmWork) -> dict:
+        return build_action(filmwork, self.index)
+
+    def gen_data(self, filmworks: Iterable[EnrichedFilmWork]):
         logger.info("Start generating data")
-        ret = []
         for filmwork in filmworks:
-            ret.append(
-                {
-                    "_index": self.index,
-                    "_id": filmwork.id,
-                    "actors": [*filmwork.get_actors()],
-                    "actors_names": filmwork.get_actors_names(),
-                    "description": filmwork.description,
-                    "director": filmwork.director,
-                    "genre": filmwork.genre,
-                    "id": filmwork.id,
-                    "imdb_rating": filmwork.imdb_rating,
-                    "title": filmwork.title,
-                    "writers": [*filmwork.get_writers()],
-                    "writers_names": filmwork.get_writers_names(),
-                }
+            yield self.build_action(filmwork)
+
+    def current_chunk_size(self) -> int:
+        if self.chunk_size is None:
+            return settings.bulk_chunk_size
+        return self.chunk_size.value
+
+    def observe_chunks(self, seconds: float, sent: int, dumped: int, throttled: int):
+        """Передает контроллеру средние время и объем одного чанка."""
+        if self.chunk_size is None or not sent:
+            return
+        chunks = -(-sent // self.chunk_size.value)
+        # В режиме parallel одновременно идут до bulk_thread_count чанков,
+        # и каждый из них занимает больше, чем общее время на число чанков.
+        in_flight = 1
+        if self.bulk_mode == "parallel":
+            in_flight = min(settings.bulk_thread_count, chunks)
+        self.chunk_size.observe(
+            seconds * in_flight / chunks, dumped // chunks, throttled
+        )
+
+    def bulk_results(self, actions: Iterable[dict]):
+        """Отправляет документы чанками, отдавая результат по каждому."""
+        options = {
+            "chunk_size": self.current_chunk_size(),
+            "max_chunk_bytes": settings.bulk_max_chunk_bytes,
+            "raise_on_error": False,
+            "raise_on_exception": False,
+        }
+        if self.bulk_mode == "parallel":
+            return parallel_bulk(
+                self.elastic,
+                actions,
+                thread_count=settings.bulk_thread_count,
+                **options,
+            )
+        return streaming_bulk(self.elastic, actions, **options)
+
+    def push_streaming(self, actions: Iterable[dict]) -> tuple[int, int]:
+        """Повторно отправляет только те документы, которые не приняты.
+
+        Документы с неповторяемой ошибкой (например, 400) логируются и
+        пропускаются. Если повторяемые ошибки не прошли за bulk_max_retries
+        попыток, выбрасывается BulkIndexError: внешний backoff повторит
+        загрузку, а чекпоинт не сдвинется.
+        """
+        indexed, rejected, failed, confirmed = 0, 0, [], []
+        errors = {}
+        self.throttled = 0
+        pending = actions
+        sleep_time = settings.bulk_retry_sleep
+        for attempt in range(settings.bulk_max_retries + 1):
+            if attempt:
+                logger.warning(
+                    f"Retrying {len(pending)} documents, attempt {attempt}"
+                )
+                sleep(sleep_time)
+                sleep_time *= 2
+            self.ensure_index()
+            in_flight, failed = {}, []
+            sent, throttled = 0, 0
+            started, dumped = perf_counter(), self.serializer.dumped
+
+            def tracked():
+                nonlocal sent
+                for action in pending:
+                    in_flight[action["_id"]] = action
+                    sent += 1
+                    yield action
+
+            for ok, item in self.bulk_results(tracked()):
+                result = next(iter(item.values()))
+                action = in_flight.pop(result["_id"], None)
+                if ok:
+                    indexed += 1
+                    confirmed.append(result["_id"])
+                    continue
+                status = result.get("status")
+                if status == 404:
+                    self.index_ready = False
+                if status == 429:
+                    throttled += 1
+                if status in RETRYABLE_STATUSES and action is not None:
+                    failed.append(action)
+                    errors[result["_id"]] = item
+                else:
+                    rejected += 1
+                    logger.error(
+                        f"Document {result['_id']} rejected: {result.get('error')}"
+                    )
+            # Повтор после 429 уходит уже уменьшенными чанками.
+            self.observe_chunks(
+                perf_counter() - started,
+                sent,
+                self.serializer.dumped - dumped,
+                throttled,
+            )
+            self.throttled += throttled
+            if not failed:
+                break
+            pending = failed
+        if self.fingerprints is not None:
+            self.fingerprints.confirm(confirmed)
+        metrics.docs_indexed.inc(indexed)
+        metrics.docs_failed.inc(rejected + len(failed))
+        if failed:
+            raise BulkIndexError(
+                f"{len(failed)} document(s) were not indexed, retries exhausted",
+                [errors[action["_id"]] for action in failed],
             )
-        return ret
+        logger.info(f"Bulk: {indexed} documents indexed, {rejected} rejected")
+        return indexed, rejected
 
     @backoff()
     def push(self, index_data):
+        # Генератор создается заново на каждой попытке backoff.
+        return self._push_actions(self.gen_data(index_data))
+
+    @backoff()
+    def push_actions(self, actions: list[dict]):
+        """Отправляет уже подготовленные bulk-документы."""
+        return self._push_actions(actions)
+
+    def _push_actions(self, actions: Iterable[dict]):
+        if self.fingerprints is not None:
+            actions = self.fingerprints.changed(actions)
+        with metrics.bulk_request_seconds.time():
+            if self.bulk_mode != "bulk":
+                result = self.push_streaming(actions)
+            else:
+                result = self._push_bulk(actions)
+        if self.fingerprints is not None:
+            logger.info(
+                f"Fingerprints: {self.fingerprints.sent} sent, "
+                f"{self.fingerprints.skipped} skipped as unchanged"
+            )
+        return result
+
+    def rename_persons(self, names: dict[str, str]) -> Optional[int]:
+        """Частичное обновление имен персон во всех фильмах с ними.
+
+        Возвращает число найденных документов (обновленных и оставшихся
+        без изменений) или None, если запрос не удался целиком.
+        """
+        ids = list(names)
+        query = {
+            "bool": {
+                "should": [
+                    {
+                        "nested": {
+                            "path": field,
+                            "query": {"terms": {f"{field}.id": ids}},
+                        }
+                    }
+                    for field in ("actors", "writers")
+                ]
+            }
+        }
+        try:
+            with metrics.bulk_request_seconds.time():
+                response = self.elastic.update_by_query(
+                    index=self.index,
+                    body={
+                        "query": query,
+                        "script": {
+                            "source": RENAME_PERSONS_SCRIPT,
+                            "lang": "painless",
+                            "params": {"names": names},
+                        },
+                    },
+                    conflicts="proceed",
+                    refresh=True,
+                )
+        except ElasticsearchException as e:
+            logger.error(f"Partial update failed: {e}")
+            return None
+        if response["failures"] or response["version_conflicts"]:
+            return None
+        logger.info(
+            f"Partial update: {response['updated']} documents updated, "
+            f"{response['noops']} unchanged"
+        )
+        return response["updated"] + response["noops"]
+
+    def _push_bulk(self, actions: Iterable[dict]):
+        self.ensure_index()
         logger.info("Creating bulk request...")
-        bulk(self.elastic, self.gen_data(index_data))
+        self.throttled = 0
+        sent = 0
+        started, dumped = perf_counter(), self.serializer.dumped
+
+        def counted():
+            nonlocal sent
+            for action in actions:
+                sent += 1
+                yield action
+
+        try:
+            indexed, _ = bulk(
+                self.elastic, counted(), chunk_size=self.current_chunk_size()
+            )
+        except (NotFoundError, BulkIndexError) as e:
+            if self.is_index_missing(e):
+                self.index_ready = False
+            if isinstance(e, BulkIndexError):
+                self.throttled = sum(
+                    item.get("status") == 429
+                    for result in e.errors
+                    for item in result.values()
+                )
+            self.observe_chunks(
+                perf_counter() - started,
+                sent,
+                self.serializer.dumped - dumped,
+                self.throttled,
+            )
+            raise
+        self.observe_chunks(
+            perf_counter() - started, sent, self.serializer.dumped - dumped, 0
+        )
+        if self.fingerprints is not None:
+            self.fingerprints.confirm()
+        metrics.docs_indexed.inc(indexed)
         logger.info("Bulk request is done!")
 
     def push_batch(self, index_data):
@@ -146,13 +462,14 @@ class ElasticAccessor(IDataAccessor):
         )
 
     def _post_init(self):
-        self.if_index_not_exist()
+        self.ensure_index()
 
 
 class Loader:
+    """Долгоживущий загрузчик: клиент и пул соединений создаются один раз."""
+
     def __init__(
         self,
-        index_data: list[any],
         conn_details: ConnectionDetails = {},
         data_accessor: IDataAccessor = ElasticAccessor,
         **extra_accessor_kwargs,
@@ -160,12 +477,19 @@ class Loader:
         self.data_accessor = data_accessor(
             **conn_details, **extra_accessor_kwargs
         )
-        self.index_data = index_data
 
-    def load(self):
+    def load(self, index_data: list[any]):
         logger.info("Start loading to Elastic objects...")
-        if not len(self.index_data):
+        if not len(index_data):
+            logger.info("Objects to load are empty!")
+            return
+        self.data_accessor.push(index_data)
+        logger.info("Objects loaded!")
+
+    def load_actions(self, actions: list[dict]):
+        """Загружает документы, подготовленные заранее, например в процессах."""
+        if not len(actions):
             logger.info("Objects to load are empty!")
             return
-        self.data_accessor.push(self.index_data)
+        self.data_accessor.push_actions(actions)
         logger.info("Objects loaded!")
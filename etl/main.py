@@ -1,42 +1,232 @@
-import datetime
-from time import sleep
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter, sleep
+from typing import Callable
 
+import metrics
+from adaptive import AIMDController
+from cdc import OutboxExtractor
+from config import settings
 from extractor import ExtractEntity
 from loader import Loader
-from state import get_all_keys_and_values, state, zone
+from partial_updates import PersonPartialUpdater
+from pipeline import run_pipeline
+from state import get_all_keys_and_values, init_state, state, zone
+from transform_pool import ProcessPoolTransformer
 from transformer import Transformer
 from utils import logger
 
+ENTITIES = ["genre", "person", "film_work"]
+
+
+def transform(batch: list[dict]) -> list:
+    trans = Transformer(batch)
+    return trans.transform_for_es()
+
+
+def measured(transform: Callable) -> Callable:
+    """Снимает время трансформации и размеры пачек."""
+
+    def inner(batch: list[dict]) -> list:
+        metrics.batch_rows.observe(len(batch))
+        with metrics.transform_seconds.time():
+            docs = transform(batch)
+        metrics.batch_docs.observe(len(docs))
+        return docs
+
+    return inner
+
+
+def build_stages(loader: Loader) -> tuple[Callable, Callable]:
+    """Трансформация в текущем процессе или в пуле процессов."""
+    if settings.transform_workers > 1:
+        pool = ProcessPoolTransformer(
+            settings.transform_workers,
+            settings.transform_pool_min_rows,
+            index=loader.data_accessor.index,
+        )
+        return measured(pool.transform), loader.load_actions
+    return measured(transform), loader.load
+
+
+def adaptive(ex: ExtractEntity, loader: Loader, load: Callable) -> Callable:
+    """Подстраивает размер страниц извлечения по времени загрузки пачки."""
+    ex.page_size = AIMDController(
+        "extract page size",
+        initial=100,
+        minimum=settings.adaptive_page_min,
+        maximum=settings.adaptive_page_max,
+        step=settings.adaptive_page_step,
+        target_seconds=settings.adaptive_page_seconds,
+        gauge=metrics.extract_page_size,
+    )
+    ex.full_load_size = AIMDController(
+        "full load page size",
+        initial=settings.full_load_itersize,
+        minimum=settings.adaptive_page_min,
+        maximum=settings.adaptive_page_max * 10,
+        step=settings.adaptive_page_step * 10,
+        target_seconds=settings.adaptive_page_seconds,
+    )
+
+    def inner(docs: list):
+        loader.data_accessor.throttled = 0
+        started = perf_counter()
+        result = load(docs)
+        if ex.current_page_size is not None:
+            ex.current_page_size.observe(
+                perf_counter() - started,
+                rejected=loader.data_accessor.throttled,
+            )
+        return result
+
+    return inner
+
+
+class SyncClock:
+    """Момент, по состоянию на который данные уже лежат в индексе."""
+
+    def __init__(self, synced_at: datetime):
+        self.synced_at = synced_at
+        self.waiting = False
+        metrics.replication_lag_seconds.set_function(self.lag)
+
+    def lag(self) -> float:
+        if self.waiting:
+            return 0.0
+        return (datetime.now(zone) - self.synced_at).total_seconds()
+
+    def synced(self, cycle_started_at: datetime):
+        self.synced_at = cycle_started_at
+
+    @contextmanager
+    def idle(self):
+        """Журнал изменений вычерпан и слушается: до NOTIFY отставания нет."""
+        self.waiting = True
+        try:
+            yield
+        finally:
+            self.waiting = False
+        self.synced(datetime.now(zone))
+
+
+def run_pipelined(
+    ex: ExtractEntity, transform: Callable, load: Callable, is_first_run: bool
+):
+    if is_first_run:
+        full_load = ((None, None, batch) for batch in ex.extract_only_fw())
+        asyncio.run(
+            run_pipeline(
+                full_load,
+                transform,
+                load,
+                queue_size=settings.pipeline_queue_size,
+            )
+        )
+        state.set_state("is_first_run", False)
+        state.flush()
+    asyncio.run(
+        run_pipeline(
+            ex.extract_checkpointed(ENTITIES),
+            transform,
+            load,
+            on_loaded=ex.save_checkpoint,
+            queue_size=settings.pipeline_queue_size,
+        )
+    )
+
+
+def run_sequential(
+    ex: ExtractEntity, transform: Callable, load: Callable, is_first_run: bool
+):
+    if is_first_run:
+        for batch in ex.extract_only_fw():
+            load(transform(batch))
+        state.set_state("is_first_run", False)
+        state.flush()
+    if settings.coalesce_entities:
+        for batch in ex.extract_coalesced(
+            ENTITIES,
+            max_filmworks=settings.coalesce_max_filmworks,
+            chunk_size=settings.coalesce_chunk_size,
+        ):
+            load(transform(batch))
+        return
+    for entity in ENTITIES:
+        logger.info(f"Looking for changes in {entity}")
+        for entity_data in ex.extract(entity=entity):
+            load(transform(entity_data))
+
+
+def run_outbox(
+    outbox: OutboxExtractor,
+    transform: Callable,
+    load: Callable,
+    is_first_run: bool,
+):
+    if is_first_run:
+        # Все, что попало в журнал до полной загрузки, она уже покрывает.
+        last_change_id = outbox.last_change_id()
+        for batch in outbox.extractor.extract_only_fw():
+            load(transform(batch))
+        outbox.discard_changes(last_change_id)
+        state.set_state("is_first_run", False)
+        state.flush()
+    for batch in outbox.extract_changes():
+        load(transform(batch))
+
 
 def main():
+    init_state(state)
+    if settings.metrics_port:
+        try:
+            metrics.start_metrics_server(
+                settings.metrics_port, settings.metrics_host
+            )
+        except OSError as e:
+            # Например, порт занят вторым ETL на этом хосте: работаем без метрик.
+            logger.error(f"Metrics server is not started: {e}")
+    clock = SyncClock(datetime.fromisoformat(str(state.get_state("time_of_run"))))
     is_first_run = state.get_state("is_first_run")
 
     if is_first_run is None:
         state.set_state("is_first_run", True)
+        state.flush()
         is_first_run = True
 
-    state.set_state("film_work_excepted_ids", None)
+    ex = ExtractEntity()
+    loader = Loader()
+    transform_stage, load_stage = build_stages(loader)
+    if settings.partial_updates:
+        if settings.pipeline:
+            # update_by_query идет из потока извлечения в обход очередей:
+            # полный документ из более ранней пачки перезапишет новое имя.
+            raise ValueError(
+                "ETL_PARTIAL_UPDATES cannot be combined with ETL_PIPELINE"
+            )
+        ex.partial_updater = PersonPartialUpdater(ex, loader.data_accessor)
+    if settings.adaptive_batches:
+        load_stage = adaptive(ex, loader, load_stage)
+    if settings.change_capture == "outbox":
+        outbox = OutboxExtractor(ex, batch_size=settings.outbox_batch_size)
+        outbox.install()
+        outbox.listen()
+        while True:
+            started_at = datetime.now(zone)
+            run_outbox(outbox, transform_stage, load_stage, is_first_run)
+            clock.synced(started_at)
+            is_first_run = False
+            with clock.idle():
+                outbox.wait_for_changes(settings.outbox_wait_timeout)
+
+    run_cycle = run_pipelined if settings.pipeline else run_sequential
     while True:
-        ex = ExtractEntity()
-        if is_first_run:
-            for batch in ex.extract_only_fw():
-                trans = Transformer(batch)
-                transformed_data = trans.transform_for_es()
-                loader = Loader(transformed_data)
-                loader.load()
-            state.set_state("is_first_run", False)
-            state.set_state("film_work_excepted_ids", None)
-        for entity in ["genre", "person", "film_work"]:
-            logger.info(f"Looking for changes in {entity}")
-            for entity_data in ex.extract(entity=entity):
-                trans = Transformer(entity_data)
-                transformed_data = trans.transform_for_es()
-                loader = Loader(transformed_data)
-                loader.load()
-            if state.get_state(f"{entity}_excepted_ids"):
-                state.set_state("time_of_run", datetime.datetime.now(zone))
-            state.set_state(f"{entity}_excepted_ids", None)
-        logger.info(get_all_keys_and_values(state))
+        started_at = datetime.now(zone)
+        run_cycle(ex, transform_stage, load_stage, is_first_run)
+        clock.synced(started_at)
+        is_first_run = False
+        logger.debug(get_all_keys_and_values(state))
         sleep(1)
 
 
@@ -0,0 +1,197 @@
+"""Метрики ETL в текстовом формате Prometheus.
+
+Собственная небольшая реализация без внешних зависимостей: счетчики,
+гистограммы и gauge, а также HTTP-эндпоинт /metrics в фоновом потоке.
+"""
+import abc
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{{{pairs}}}"
+
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def samples(self) -> list[str]:
+        pass
+
+    def expose(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values) or {(): 0}
+        return [
+            f"{self.name}{_labels(dict(key))} {value}"
+            for key, value in values.items()
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Значение вычисляется в момент запроса метрик."""
+        self._function = function
+
+    def samples(self) -> list[str]:
+        value = self._function() if self._function else self._value
+        return [f"{self.name} {value}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            lines = [
+                f'{self.name}_bucket{{le="{bound}"}} {count}'
+                for bound, count in zip(self.buckets, self._counts)
+            ]
+            lines += [
+                f'{self.name}_bucket{{le="+Inf"}} {self._count}',
+                f"{self.name}_sum {self._sum}",
+                f"{self.name}_count {self._count}",
+            ]
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        return "\n".join(metric.expose() for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+extract_query_seconds = registry.register(
+    Histogram("etl_extract_query_seconds", "Postgres query time in the extractor")
+)
+transform_seconds = registry.register(
+    Histogram("etl_transform_seconds", "Time to transform one batch")
+)
+bulk_request_seconds = registry.register(
+    Histogram("etl_bulk_request_seconds", "Time to push one batch to Elasticsearch")
+)
+batch_rows = registry.register(
+    Histogram("etl_batch_rows", "Rows per extracted batch", SIZE_BUCKETS)
+)
+batch_docs = registry.register(
+    Histogram("etl_batch_docs", "Documents per transformed batch", SIZE_BUCKETS)
+)
+docs_indexed = registry.register(
+    Counter("etl_docs_indexed_total", "Documents accepted by Elasticsearch")
+)
+docs_failed = registry.register(
+    Counter("etl_docs_failed_total", "Documents rejected by Elasticsearch")
+)
+backoff_retries = registry.register(
+    Counter("etl_backoff_retries_total", "Retries made by backoff decorators")
+)
+replication_lag_seconds = registry.register(
+    Gauge(
+        "etl_replication_lag_seconds",
+        "Seconds since the start of the last completed ETL cycle",
+    )
+)
+extract_page_size = registry.register(
+    Gauge("etl_extract_page_size", "Current adaptive extract page size")
+)
+bulk_chunk_size = registry.register(
+    Gauge("etl_bulk_chunk_size", "Current adaptive bulk chunk size")
+)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        payload = registry.expose().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,54 @@
+from typing import Generator
+
+from loader import ElasticAccessor
+from psycopg2.extensions import cursor
+from sql_utils import person_roles_sql
+from utils import logger
+
+
+class PersonPartialUpdater:
+    """Переименование персон частичным обновлением документов.
+
+    Вместо полной выборки и переиндексации каждого фильма с измененной
+    персоной в Elastic уходит один update_by_query на страницу персон.
+    Число найденных документов сверяется с числом фильмов в Postgres; при
+    расхождении (новая связь, неуспевший refresh, конфликт версий) фильмы
+    идут по обычному пути. Режиссеры в документе хранятся только строкой
+    имен без id, поэтому их фильмы всегда обновляются полностью.
+    """
+
+    def __init__(self, extractor, accessor: ElasticAccessor):
+        self.extractor = extractor
+        self.accessor = accessor
+
+    def filmworks_to_rebuild(
+        self,
+        cursor: cursor,
+        entity_ids: Generator[list[str], None, None],
+    ) -> Generator[list[str], None, None]:
+        """Заменяет extract_modified_filmworks для сущности person."""
+        for batch in entity_ids:
+            self.extractor.make_query(
+                cursor, person_roles_sql, {"ids": [str(id) for id in batch]}
+            )
+            names, patched, rebuild = {}, set(), set()
+            for person_id, full_name, role, filmwork_id in cursor.fetchall():
+                if role in ("actor", "writer"):
+                    names[str(person_id)] = full_name
+                    patched.add(filmwork_id)
+                else:
+                    rebuild.add(filmwork_id)
+            if names:
+                matched = self.accessor.rename_persons(names)
+                if matched != len(patched):
+                    logger.info(
+                        f"Partial update matched {matched} of {len(patched)} "
+                        "film_work, falling back to full rebuild"
+                    )
+                    rebuild |= patched
+                if self.accessor.fingerprints is not None:
+                    # Документы изменены в обход хэшей, старые хэши неверны.
+                    self.accessor.fingerprints.forget(patched)
+            if rebuild:
+                logger.info(f"{len(rebuild)} film_work to rebuild, based on person")
+                yield list(rebuild)
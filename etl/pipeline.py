@@ -0,0 +1,70 @@
+import asyncio
+from typing import Callable, Iterable, Optional
+
+from utils import logger
+
+# Элемент конвейера: (сущность, чекпоинт, строки из Postgres).
+Batch = tuple[Optional[str], Optional[dict], list]
+
+_DONE = object()
+
+
+async def extract_stage(source: Iterable[Batch], queue: asyncio.Queue):
+    """Читает пачки в отдельном потоке, ожидая места в очереди."""
+    batches = iter(source)
+    while (item := await asyncio.to_thread(next, batches, _DONE)) is not _DONE:
+        await queue.put(item)
+    await queue.put(_DONE)
+
+
+async def transform_stage(
+    in_queue: asyncio.Queue, out_queue: asyncio.Queue, transform: Callable
+):
+    while (item := await in_queue.get()) is not _DONE:
+        entity, checkpoint, rows = item
+        if rows:
+            rows = await asyncio.to_thread(transform, rows)
+        await out_queue.put((entity, checkpoint, rows))
+    await out_queue.put(_DONE)
+
+
+async def load_stage(
+    queue: asyncio.Queue,
+    load: Callable,
+    on_loaded: Optional[Callable[[str, dict], None]],
+):
+    """Грузит пачки по порядку и двигает чекпоинт только после загрузки."""
+    while (item := await queue.get()) is not _DONE:
+        entity, checkpoint, objects = item
+        if objects:
+            await asyncio.to_thread(load, objects)
+        if on_loaded is not None and entity is not None and checkpoint:
+            await asyncio.to_thread(on_loaded, entity, checkpoint)
+
+
+async def run_pipeline(
+    source: Iterable[Batch],
+    transform: Callable,
+    load: Callable,
+    on_loaded: Optional[Callable[[str, dict], None]] = None,
+    queue_size: int = 2,
+):
+    """Извлечение, трансформация и загрузка идут одновременно.
+
+    Пока пачка N индексируется, пачка N+1 уже читается из Postgres.
+    Ограниченные очереди держат в памяти не больше queue_size пачек на стадию.
+    """
+    extracted = asyncio.Queue(maxsize=queue_size)
+    transformed = asyncio.Queue(maxsize=queue_size)
+    stages = [
+        asyncio.create_task(extract_stage(source, extracted)),
+        asyncio.create_task(transform_stage(extracted, transformed, transform)),
+        asyncio.create_task(load_stage(transformed, load, on_loaded)),
+    ]
+    try:
+        await asyncio.gather(*stages)
+    except Exception:
+        for stage in stages:
+            stage.cancel()
+        raise
+    logger.info("Pipeline cycle finished")
@@ -0,0 +1,118 @@
+"""Полная переиндексация без простоя.
+
+Фильмы грузятся в новый индекс movies_v<N> с выключенным refresh и без
+реплик, затем настройки возвращаются, индекс сливается в один сегмент,
+в него догоняются изменения, сделанные за время загрузки, и алиас movies
+атомарно переключается на него. Читатели не видят недостроенный индекс.
+
+Запуск из каталога etl: python reindex.py
+"""
+import copy
+import datetime
+import re
+
+from config import settings
+from elasticsearch import Elasticsearch
+from extractor import ExtractEntity
+from loader import MOVIES_INDEX_BODY, Loader
+from main import ENTITIES, build_stages
+from state import init_state, state, zone
+from utils import logger
+
+
+def next_index_name(elastic: Elasticsearch, alias: str) -> str:
+    pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+    versions = [
+        int(match.group(1))
+        for name in elastic.indices.get(index=f"{alias}_v*")
+        if (match := pattern.match(name))
+    ]
+    return f"{alias}_v{max(versions, default=0) + 1}"
+
+
+def create_bulk_index(elastic: Elasticsearch, index: str):
+    """Индекс с настройками для быстрой массовой загрузки."""
+    body = copy.deepcopy(MOVIES_INDEX_BODY)
+    body["settings"]["refresh_interval"] = "-1"
+    body["settings"]["number_of_replicas"] = 0
+    elastic.indices.create(index=index, body=body)
+    logger.info(f"Index {index} created for reindex")
+
+
+def finalize_index(elastic: Elasticsearch, index: str, replicas: int):
+    elastic.indices.put_settings(
+        index=index,
+        body={
+            "index": {
+                "refresh_interval": MOVIES_INDEX_BODY["settings"]["refresh_interval"],
+                "number_of_replicas": replicas,
+            }
+        },
+    )
+    elastic.indices.forcemerge(
+        index=index, max_num_segments=1, request_timeout=3600
+    )
+    elastic.indices.refresh(index=index)
+
+
+def swap_alias(elastic: Elasticsearch, alias: str, index: str) -> list[str]:
+    """Атомарно направляет алиас на новый индекс, возвращает старые индексы."""
+    actions = [{"add": {"index": index, "alias": alias}}]
+    old_indices = []
+    if elastic.indices.exists_alias(name=alias):
+        old_indices = list(elastic.indices.get_alias(name=alias))
+        actions = [
+            {"remove": {"index": old, "alias": alias}} for old in old_indices
+        ] + actions
+    elif elastic.indices.exists(index=alias):
+        # Старый индекс с именем алиаса удаляется в том же запросе.
+        actions.append({"remove_index": {"index": alias}})
+    elastic.indices.update_aliases(body={"actions": actions})
+    logger.info(f"Alias {alias} now points to {index}")
+    return old_indices
+
+
+def catch_up(
+    ex: ExtractEntity, transform, load, since: datetime.datetime
+) -> None:
+    """Догоняет в новый индекс изменения, сделанные после since."""
+    ex.defer_checkpoints = True
+    for entity in ENTITIES:
+        for batch in ex.extract(entity=entity, since=since):
+            load(transform(batch))
+
+
+def reindex(alias: str = "movies", replicas: int = 1) -> str:
+    init_state(state)
+    started = datetime.datetime.now(zone)
+    ex = ExtractEntity()
+    # Отпечатки относятся к живому индексу, новый заполняется целиком.
+    loader = Loader(index=alias, skip_unchanged=False, check_index=False)
+    accessor = loader.data_accessor
+    index = next_index_name(accessor.elastic, alias)
+    create_bulk_index(accessor.elastic, index)
+    accessor.index = index
+    accessor.index_ready = True
+
+    transform, load = build_stages(loader)
+    for batch in ex.extract_only_fw():
+        load(transform(batch))
+    finalize_index(accessor.elastic, index, replicas)
+
+    # Изменения, сделанные во время загрузки, попадают в новый индекс до
+    # переключения алиаса; после него догоняется только короткий хвост.
+    caught_up = datetime.datetime.now(zone)
+    catch_up(ex, transform, load, since=started)
+    accessor.elastic.indices.refresh(index=index)
+    old_indices = swap_alias(accessor.elastic, alias, index)
+    catch_up(ex, transform, load, since=caught_up)
+
+    state.set_state("is_first_run", False)
+    state.flush()
+    if old_indices:
+        logger.info(f"Previous indices kept for rollback: {old_indices}")
+    return index
+
+
+if __name__ == "__main__":
+    reindex(replicas=settings.es_replicas)
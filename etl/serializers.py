@@ -0,0 +1,82 @@
+"""Сериализация JSON для bulk-запросов и хранилищ состояния.
+
+По умолчанию используется orjson, если он установлен, иначе stdlib json.
+Оба варианта дают компактный вывод и одинаково кодируют datetime, date и
+UUID, которые возвращает psycopg2, так что документы не нужно готовить
+заранее.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from uuid import UUID
+
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def default(obj):
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+if orjson is not None:
+
+    def dumps_bytes(obj, sort_keys: bool = False) -> bytes:
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        return orjson.dumps(obj, default=default, option=option)
+
+    loads = orjson.loads
+
+else:
+
+    def dumps_bytes(obj, sort_keys: bool = False) -> bytes:
+        return json.dumps(
+            obj,
+            default=default,
+            sort_keys=sort_keys,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    loads = json.loads
+
+
+def dumps(obj, sort_keys: bool = False) -> str:
+    return dumps_bytes(obj, sort_keys).decode("utf-8")
+
+
+class ElasticSerializer(JSONSerializer):
+    """Сериализатор клиента Elasticsearch на том же кодировщике.
+
+    Считает объем сериализованных данных в байтах UTF-8, чтобы загрузчик
+    знал размер отправленных bulk-запросов.
+    """
+
+    def __init__(self):
+        self.dumped = 0
+
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+        try:
+            encoded = dumps_bytes(data)
+        except (TypeError, ValueError) as e:
+            raise SerializationError(data, e)
+        self.dumped += len(encoded)
+        return encoded.decode("utf-8")
+
+    def loads(self, s):
+        try:
+            return loads(s)
+        except (TypeError, ValueError) as e:
+            raise SerializationError(s, e)
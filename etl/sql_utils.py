@@ -1,3 +1,22 @@
+ZERO_UUID = "00000000-0000-0000-0000-000000000000"
+
+modified_entities_sql_template = """
+    SELECT id, modified
+    FROM content.%(entity)s
+    WHERE (modified, id) > (%%(modified)s, %%(id)s)
+    ORDER BY modified, id
+    %(lim)s;
+"""
+
+modified_filmworks_sql_template = """
+    SELECT fw.id, fw.modified
+    FROM content.film_work fw
+    LEFT JOIN content.%(entity)s_film_work pfw ON pfw.film_work_id = fw.id
+    WHERE pfw.%(entity)s_id IN (%(ids)s)
+    ORDER BY fw.modified
+    %(lim)s;
+"""
+
 full_filmwork_data_sql_template = """
     SELECT
         fw.id,
@@ -17,5 +36,68 @@ full_filmwork_data_sql_template = """
     LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
     LEFT JOIN content.genre g ON g.id = gfw.genre_id
     %(where)s
+    -- Стабильный порядок строк дает одинаковые документы (и их отпечатки)
+    -- при полной и инкрементальной выборке.
+    ORDER BY fw.id, pfw.role, p.full_name, p.id, g.name
     %(lim)s;
 """
+
+aggregated_filmwork_data_sql_template = """
+    SELECT
+        fw.id,
+        fw.title,
+        fw.description,
+        fw.rating,
+        fw.type,
+        fw.created,
+        fw.modified,
+        COALESCE(persons.actors, '[]') as actors,
+        COALESCE(persons.writers, '[]') as writers,
+        COALESCE(persons.directors, '{}') as directors,
+        COALESCE(genres.names, '{}') as genres
+    FROM content.film_work fw
+    CROSS JOIN LATERAL (
+        SELECT
+            json_agg(
+                json_build_object('id', p.id, 'name', p.full_name)
+                ORDER BY p.full_name, p.id
+            ) FILTER (WHERE pfw.role = 'actor') as actors,
+            json_agg(
+                json_build_object('id', p.id, 'name', p.full_name)
+                ORDER BY p.full_name, p.id
+            ) FILTER (WHERE pfw.role = 'writer') as writers,
+            array_agg(p.full_name ORDER BY p.full_name, p.id)
+                FILTER (WHERE pfw.role = 'director') as directors
+        FROM content.person_film_work pfw
+        JOIN content.person p ON p.id = pfw.person_id
+        WHERE pfw.film_work_id = fw.id
+    ) persons
+    CROSS JOIN LATERAL (
+        SELECT array_agg(DISTINCT g.name ORDER BY g.name) as names
+        FROM content.genre_film_work gfw
+        JOIN content.genre g ON g.id = gfw.genre_id
+        WHERE gfw.film_work_id = fw.id
+    ) genres
+    %(where)s
+    ORDER BY fw.id
+    %(lim)s;
+"""
+
+drain_outbox_sql = """
+    DELETE FROM content.change_outbox
+    WHERE id IN (
+        SELECT id
+        FROM content.change_outbox
+        ORDER BY id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING entity, entity_id;
+"""
+
+person_roles_sql = """
+    SELECT p.id, p.full_name, pfw.role, pfw.film_work_id
+    FROM content.person p
+    JOIN content.person_film_work pfw ON pfw.person_id = p.id
+    WHERE p.id = ANY(%(ids)s::uuid[]);
+"""
@@ -0,0 +1,100 @@
+"""Сравнение подготовки строк SQLite к INSERT: старый путь и проекция.
+
+Старый путь: dict(row) -> фильтр по полям -> dataclass -> astuple.
+Новый: itemgetter по индексам, посчитанным один раз из cursor.description.
+
+    python bench_projection.py --rows 100000 --batch-size 1000
+"""
+import argparse
+import sqlite3
+import time
+import tracemalloc
+import uuid
+from dataclasses import astuple
+
+from dto.movies_objects import FilmWork
+
+
+def make_db(rows: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE film_work (id TEXT, title TEXT, description TEXT, "
+        "creation_date DATE, certificate TEXT, file_path TEXT, rating FLOAT, "
+        "type TEXT, created_at TIMESTAMP, updated_at TIMESTAMP);"
+    )
+    conn.executemany(
+        "INSERT INTO film_work VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+        (
+            (
+                str(uuid.uuid4()),
+                f"Film {i}",
+                "Description " * 5,
+                "2020-01-01",
+                None,
+                None,
+                7.5,
+                "movie",
+                "2021-06-16 20:14:09.221838+00",
+                "2021-06-16 20:14:09.221838+00",
+            )
+            for i in range(rows)
+        ),
+    )
+    return conn
+
+
+def dataclass_path(conn: sqlite3.Connection, batch_size: int):
+    curs = conn.cursor()
+    curs.row_factory = sqlite3.Row
+    curs.execute("SELECT * FROM film_work;")
+    while data := curs.fetchmany(batch_size):
+        objs = []
+        for r in data:
+            r_dict = {
+                k: v
+                for k, v in dict(r).items()
+                if k in FilmWork.__dataclass_fields__.keys()
+            }
+            objs.append(astuple(FilmWork(**r_dict)))
+        yield objs
+
+
+def projection_path(conn: sqlite3.Connection, batch_size: int):
+    curs = conn.cursor()
+    curs.execute("SELECT * FROM film_work;")
+    project = FilmWork.get_projection(curs.description)
+    while data := curs.fetchmany(batch_size):
+        yield list(map(project, data))
+
+
+def measure(name: str, path, conn: sqlite3.Connection, batch_size: int) -> None:
+    """Пачки сразу выбрасываются, как после INSERT; пик памяти — на пачку."""
+    start = time.perf_counter()
+    rows = sum(len(batch) for batch in path(conn, batch_size))
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    for _ in path(conn, batch_size):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name}: {elapsed / rows * 1e6:.2f} us/row, "
+        f"{rows / elapsed:,.0f} rows/s, peak {peak / batch_size:.0f} B/row"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    conn = make_db(args.rows)
+    assert list(dataclass_path(conn, args.batch_size)) == list(
+        projection_path(conn, args.batch_size)
+    )
+    measure("dataclass", dataclass_path, conn, args.batch_size)
+    measure("projection", projection_path, conn, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import io
+from typing import Iterator, Optional
+
+# Маркер NULL для COPY: строки всегда в кавычках, поэтому строковое
+# значение "\N" не спутать с NULL.
+COPY_NULL = "\\N"
+
+
+def to_csv_field(value) -> str:
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+def to_csv_line(row) -> str:
+    return ",".join(to_csv_field(value) for value in row) + "\n"
+
+
+class RowsCSVStream(io.TextIOBase):
+    """Файлоподобный объект для copy_expert: CSV строится по мере чтения."""
+
+    def __init__(self, rows: Iterator[tuple]):
+        self.rows = rows
+        self.buffer = ""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        chunks, length = [self.buffer], len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = to_csv_line(row)
+            chunks.append(line)
+            length += len(line)
+        data = "".join(chunks)
+        if size < 0:
+            self.buffer = ""
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def iter_rows(sqlite_cursor, batch_size: int) -> Iterator[tuple]:
+    while data := sqlite_cursor.fetchmany(batch_size):
+        yield from data
+
+
+def copy_table(
+    sqlite_cursor,
+    psqlconn,
+    table: str,
+    dto,
+    batch_size: int,
+    rowid_range: Optional[tuple[int, int]] = None,
+) -> int:
+    """Переносит таблицу через COPY во временную таблицу и INSERT ... SELECT.
+
+    Вся таблица (или диапазон rowid включительно) переносится одной
+    транзакцией; дубликаты отбрасывает ON CONFLICT DO NOTHING, как и в
+    режиме INSERT.
+    """
+    columns = ", ".join(dto.get_sqlite_columns())
+    headers = dto.get_psql_headers()
+    target = dto.get_psql_table_name()
+    staging = f"staging_{table}"
+
+    if rowid_range is None:
+        sqlite_cursor.execute(f"SELECT {columns} FROM {table};")
+    else:
+        sqlite_cursor.execute(
+            f"SELECT {columns} FROM {table} WHERE rowid BETWEEN ? AND ?;",
+            rowid_range,
+        )
+    with psqlconn.cursor() as psqlcur:
+        psqlcur.execute(
+            f"CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) "
+            "ON COMMIT DROP;"
+        )
+        psqlcur.copy_expert(
+            f"COPY {staging} ({headers}) FROM STDIN "
+            f"WITH (FORMAT csv, NULL '{COPY_NULL}');",
+            RowsCSVStream(iter_rows(sqlite_cursor, batch_size)),
+            size=1024 * 1024,
+        )
+        psqlcur.execute(
+            f"INSERT INTO {target} ({headers}) "
+            f"SELECT {headers} FROM {staging} ON CONFLICT DO NOTHING;"
+        )
+        inserted = psqlcur.rowcount
+    psqlconn.commit()
+    return inserted
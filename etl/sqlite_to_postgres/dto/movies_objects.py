@@ -1,10 +1,27 @@
 import uuid
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import date, datetime
+from operator import itemgetter
+
+
+class MovieObject:
+    @classmethod
+    def get_sqlite_columns(cls) -> tuple[str, ...]:
+        return tuple(field.name for field in fields(cls))
+
+    @classmethod
+    def get_projection(cls, description) -> itemgetter:
+        """Строка SQLite -> кортеж в порядке get_psql_headers.
+
+        Индексы колонок считаются один раз по cursor.description, лишние
+        колонки SQLite отбрасываются.
+        """
+        names = [column[0] for column in description]
+        return itemgetter(*(names.index(name) for name in cls.get_sqlite_columns()))
 
 
 @dataclass
-class Genre:
+class Genre(MovieObject):
     id: uuid.uuid4
     name: str
     description: str
@@ -24,7 +41,7 @@ class Genre:
 
 
 @dataclass
-class FilmWork:
+class FilmWork(MovieObject):
     id: uuid.uuid4
     title: str
     description: str
@@ -47,7 +64,7 @@ class FilmWork:
 
 
 @dataclass
-class GenreFilmWork:
+class GenreFilmWork(MovieObject):
     id: uuid.uuid4
     genre_id: uuid.uuid4
     film_work_id: uuid.uuid4
@@ -66,7 +83,7 @@ class GenreFilmWork:
 
 
 @dataclass
-class Person:
+class Person(MovieObject):
     id: uuid.uuid4
     full_name: str
     created_at: datetime
@@ -82,7 +99,7 @@ class Person:
 
 
 @dataclass
-class PersonFilmWork:
+class PersonFilmWork(MovieObject):
     id: uuid.uuid4
     person_id: uuid.uuid4
     film_work_id: uuid.uuid4
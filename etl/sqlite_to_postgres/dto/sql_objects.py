@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Mapping, Tuple, list
+from typing import Mapping, Tuple
 
 
 @dataclass
@@ -1,6 +1,6 @@
 import os
-from dataclasses import astuple
 
+from copy_ingest import copy_table
 from dotenv import load_dotenv
 from dto.movies_objects import (
     FilmWork,
@@ -9,8 +9,8 @@ from dto.movies_objects import (
     Person,
     PersonFilmWork,
 )
-from dto.sql_objects import PsqlRes, SQLiteRow
 from utils import conn_context, psql_conn_context
+from verify import verify_tables
 
 load_dotenv()
 objects = [FilmWork, Genre, GenreFilmWork, Person, PersonFilmWork]
@@ -20,6 +20,8 @@ psqlhostname = os.getenv("PSQLHOSTNAME")
 psqldbname = os.getenv("PSQLDBNAME")
 psqluser = os.getenv("PSQLUSER")
 psqlport = os.getenv("PSQLPORT")
+# insert — пачки INSERT ... VALUES, copy — COPY через временную таблицу.
+ingest_mode = os.getenv("INGEST_MODE", "insert")
 
 
 def pick_object(
@@ -40,6 +42,19 @@ def pick_object(
     return ret
 
 
+def insert_batch(psqlcur, dto, data, project) -> None:
+    """project — dto.get_projection(cursor.description) для этой выборки."""
+    objs = list(map(project, data))
+    insert_template = ",".join(["%s"] * len(objs))
+    insert_sql = "insert into {0} ({1}) values {2} ON CONFLICT DO \
+        NOTHING;".format(
+        dto.get_psql_table_name(),
+        dto.get_psql_headers(),
+        insert_template,
+    )
+    psqlcur.execute(insert_sql, objs)
+
+
 def main() -> None:
     batch_size = int(os.getenv("BATCH_SIZE"))
 
@@ -49,59 +64,41 @@ def main() -> None:
         psqlcur = psqlconn.cursor()
         with conn_context(os.getenv("DB_NAME")) as conn:
             curs = conn.cursor()
+            curs.row_factory = None
             for i in tables:
                 if i is None or i == "":
                     continue
                 dto = pick_object(i)
+                if ingest_mode == "copy":
+                    inserted = copy_table(curs, psqlconn, i, dto, batch_size)
+                    print(f"{i}: {inserted} rows copied")
+                    continue
                 curs.execute(f"SELECT * FROM {i};")
+                project = dto.get_projection(curs.description)
                 while data := curs.fetchmany(batch_size):
-                    batch_to_insert = []
-                    insert_template = ""
-                    for r in data:
-                        r_dict = {
-                            k: v
-                            for k, v in dict(r).items()
-                            if k in dto.__dataclass_fields__.keys()
-                        }
-                        batch_to_insert.append(dto(**r_dict))
-                    objs = [astuple(o) for o in batch_to_insert]
-                    insert_template = ",".join(["%s"] * len(objs))
-                    insert_sql = "insert into {0} ({1}) values {2} ON CONFLICT DO \
-                        NOTHING;".format(
-                        dto.get_psql_table_name(),
-                        dto.get_psql_headers(),
-                        insert_template,
-                    )
-                    psqlcur.execute(insert_sql, objs)
+                    insert_batch(psqlcur, dto, data, project)
                     psqlconn.commit()
     print("All tables moved to Postgres!")
 
 
 def after_test():
-    with psql_conn_context(
-        psqlhostname, psqlport, psqldbname, psqluser, psqlpassword
-    ) as psqlconn:
-        psqlcurr = psqlconn.cursor()
-        with conn_context(os.getenv("DB_NAME")) as liteconn:
-            litecurr = liteconn.cursor()
-            for i in tables:
-                if i is None or i == "":
-                    break
-                postgre_sql = f"SELECT COUNT(*) from content.{i};"
-                lite_sql = f"SELECT COUNT(*) from {i};"
-
-                psqlcurr.execute(postgre_sql)
-                litecurr.execute(lite_sql)
-
-                psql_res = PsqlRes(psqlcurr.fetchall())
-                lite_res = SQLiteRow(
-                    dict(*[dict(r) for r in litecurr.fetchall()])
-                )
-
-                psql_val = psql_res.result[0][0]
-                lite_val = list(lite_res.result.values())[0]
-
-                assert psql_val == lite_val
+    """Сверка по контрольным суммам чанков вместо сравнения COUNT(*)."""
+    problems = verify_tables(
+        [(table, pick_object(table)) for table in tables if table],
+        os.getenv("DB_NAME"),
+        {
+            "host": psqlhostname,
+            "port": psqlport,
+            "dbname": psqldbname,
+            "user": psqluser,
+            "password": psqlpassword,
+        },
+        chunk_size=int(os.getenv("VERIFY_CHUNK_SIZE", "10000")),
+        workers=int(os.getenv("VERIFY_WORKERS", "4")),
+    )
+    for problem in problems:
+        print(problem)
+    assert not problems
     print("All tests passed!")
 
 
@@ -0,0 +1,134 @@
+"""Параллельный перенос с продолжением после сбоя.
+
+Таблицы делятся на диапазоны rowid, диапазоны переносятся пулом потоков,
+у каждого потока свои соединения с SQLite и Postgres. Последний
+перенесенный rowid каждого диапазона пишется в JSON-файл прогресса, так что
+повторный запуск продолжает с места остановки. Сначала переносятся
+родительские таблицы, затем таблицы связей, которые на них ссылаются.
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+
+from copy_ingest import copy_table
+from main import (
+    ingest_mode,
+    insert_batch,
+    pick_object,
+    psqldbname,
+    psqlhostname,
+    psqlpassword,
+    psqlport,
+    psqluser,
+    tables,
+)
+from utils import conn_context, psql_conn_context
+
+PARENT_TABLES = ("film_work", "person", "genre")
+
+workers = int(os.getenv("MIGRATION_WORKERS", "4"))
+range_size = int(os.getenv("MIGRATION_RANGE_SIZE", "50000"))
+progress_path = os.getenv("MIGRATION_PROGRESS", "migration_progress.json")
+
+
+class Progress:
+    """Последний перенесенный rowid по диапазонам, атомарно в JSON-файле."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as progress_file:
+                self.data = json.load(progress_file)
+        except FileNotFoundError:
+            self.data = {}
+
+    def last(self, key: str) -> Optional[int]:
+        with self.lock:
+            return self.data.get(key)
+
+    def save(self, key: str, rowid: int) -> None:
+        with self.lock:
+            self.data[key] = rowid
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as progress_file:
+                json.dump(self.data, progress_file)
+            os.replace(tmp_path, self.path)
+
+
+def split_ranges(liteconn, table: str, size: int) -> list[tuple[int, int]]:
+    lo, hi = liteconn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table};").fetchone()
+    if lo is None:
+        return []
+    return [(start, min(start + size - 1, hi)) for start in range(lo, hi + 1, size)]
+
+
+def migrate_range(
+    table: str, lo: int, hi: int, progress: Progress, batch_size: int
+) -> None:
+    key = f"{table}:{lo}:{hi}"
+    last = progress.last(key)
+    start = lo if last is None else last + 1
+    if start > hi:
+        return
+    dto = pick_object(table)
+    with psql_conn_context(
+        psqlhostname, psqlport, psqldbname, psqluser, psqlpassword
+    ) as psqlconn:
+        with conn_context(os.getenv("DB_NAME")) as liteconn:
+            curs = liteconn.cursor()
+            curs.row_factory = None
+            if ingest_mode == "copy":
+                copy_table(curs, psqlconn, table, dto, batch_size, (start, hi))
+            else:
+                psqlcur = psqlconn.cursor()
+                curs.execute(
+                    f"SELECT rowid AS migration_rowid, * FROM {table} "
+                    "WHERE rowid BETWEEN ? AND ? ORDER BY rowid;",
+                    (start, hi),
+                )
+                project = dto.get_projection(curs.description)
+                while data := curs.fetchmany(batch_size):
+                    insert_batch(psqlcur, dto, data, project)
+                    psqlconn.commit()
+                    progress.save(key, data[-1][0])
+    progress.save(key, hi)
+    print(f"{table}: rows {start}-{hi} moved")
+
+
+def run_phase(
+    executor: ThreadPoolExecutor,
+    phase_tables: list[str],
+    progress: Progress,
+    batch_size: int,
+) -> None:
+    with conn_context(os.getenv("DB_NAME")) as liteconn:
+        ranges = [
+            (table, lo, hi)
+            for table in phase_tables
+            for lo, hi in split_ranges(liteconn, table, range_size)
+        ]
+    futures = [
+        executor.submit(migrate_range, table, lo, hi, progress, batch_size)
+        for table, lo, hi in ranges
+    ]
+    for future in as_completed(futures):
+        future.result()
+
+
+def migrate() -> None:
+    batch_size = int(os.getenv("BATCH_SIZE"))
+    progress = Progress(progress_path)
+    selected = [table for table in tables if table]
+    parents = [table for table in selected if table in PARENT_TABLES]
+    links = [table for table in selected if table not in PARENT_TABLES]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        run_phase(executor, parents, progress, batch_size)
+        run_phase(executor, links, progress, batch_size)
+    print("All tables moved to Postgres!")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,225 @@
+"""Сверка перенесенных данных по контрольным суммам чанков.
+
+Таблица делится на чанки по порядку id. Для каждого чанка с обеих сторон
+считается число строк и сумма md5 канонического текста строк по модулю
+2^64, которая не зависит от порядка строк. В Postgres сумма считается
+агрегатом в SQL, в SQLite — потоково в Python. Чанки сверяются
+параллельно, построчно сравниваются только не совпавшие.
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+import psycopg2
+
+NULL = "\\N"
+SEPARATOR = "\x1f"
+MOD = 2**64
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+SHORT_OFFSET = re.compile(r"[+-]\d\d$")
+
+
+def column_kind(column: str) -> str:
+    if column in ("created", "modified"):
+        return "timestamp"
+    if column == "creation_date":
+        return "date"
+    if column == "rating":
+        return "float"
+    if column == "id" or column.endswith("_id"):
+        return "uuid"
+    return "text"
+
+
+def psql_column_text(column: str) -> str:
+    match column_kind(column):
+        case "timestamp":
+            value = f"round(extract(epoch FROM {column}) * 1000000)::bigint::text"
+        case "text":
+            value = column
+        case _:
+            value = f"{column}::text"
+    return f"coalesce({value}, E'\\\\N')"
+
+
+def psql_row_text(headers: list[str]) -> str:
+    columns = ", ".join(psql_column_text(column) for column in headers)
+    return f"concat_ws(E'\\x1f', {columns})"
+
+
+def canonical(kind: str, value) -> str:
+    """Значение из SQLite в том же виде, что выдает psql_column_text."""
+    if value is None:
+        return NULL
+    match kind:
+        case "timestamp":
+            value = str(value)
+            if SHORT_OFFSET.search(value):
+                value += ":00"
+            moment = datetime.fromisoformat(value)
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            return str((moment - EPOCH) // timedelta(microseconds=1))
+        case "date":
+            return date.fromisoformat(str(value)[:10]).isoformat()
+        case "float":
+            value = float(value)
+            return str(int(value)) if value.is_integer() else repr(value)
+        case "uuid":
+            return str(value).lower()
+    return str(value)
+
+
+def row_hash(text: str) -> int:
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class TableVerifier:
+    def __init__(
+        self,
+        table: str,
+        dto,
+        sqlite_path: str,
+        psql_details: dict,
+        chunk_size: int = 10000,
+    ):
+        self.table = table
+        self.sqlite_path = sqlite_path
+        self.psql_details = psql_details
+        self.chunk_size = chunk_size
+        self.lite_columns = list(dto.get_sqlite_columns())
+        self.headers = dto.get_psql_headers().split(", ")
+        self.kinds = [column_kind(column) for column in self.headers]
+        self.psql_table = dto.get_psql_table_name()
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def lite(self) -> sqlite3.Connection:
+        if not hasattr(self.local, "lite"):
+            # Закрывается из основного потока, используется только своим.
+            self.local.lite = sqlite3.connect(
+                self.sqlite_path, check_same_thread=False
+            )
+            with self.lock:
+                self.connections.append(self.local.lite)
+        return self.local.lite
+
+    def psql(self):
+        if not hasattr(self.local, "psql"):
+            self.local.psql = psycopg2.connect(**self.psql_details)
+            self.local.psql.autocommit = True
+            with self.lock:
+                self.connections.append(self.local.psql)
+        return self.local.psql
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+
+    def chunks(self) -> list[tuple[Optional[str], Optional[str]]]:
+        """Границы [lo, hi) по id; порядок строк uuid совпадает в обеих базах."""
+        cursor = self.lite().execute(f"SELECT id FROM {self.table} ORDER BY id;")
+        bounds = [
+            row[0].lower()
+            for number, row in enumerate(cursor)
+            if number % self.chunk_size == 0
+        ]
+        bounds[:1] = [None]
+        return list(zip(bounds, bounds[1:] + [None]))
+
+    def where(self, lo: Optional[str], hi: Optional[str], cast: str = ""):
+        conditions, params = [], []
+        if lo is not None:
+            conditions.append(f"id >= %s{cast}")
+            params.append(lo)
+        if hi is not None:
+            conditions.append(f"id < %s{cast}")
+            params.append(hi)
+        sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return sql, params
+
+    def lite_rows(self, lo, hi) -> Iterator[tuple[str, str]]:
+        sql, params = self.where(lo, hi)
+        cursor = self.lite().execute(
+            f"SELECT {', '.join(self.lite_columns)} FROM {self.table} "
+            + sql.replace("%s", "?"),
+            params,
+        )
+        for row in cursor:
+            text = SEPARATOR.join(
+                canonical(kind, value) for kind, value in zip(self.kinds, row)
+            )
+            yield str(row[0]).lower(), text
+
+    def lite_checksum(self, lo, hi) -> tuple[int, int]:
+        count, total = 0, 0
+        for _, text in self.lite_rows(lo, hi):
+            count += 1
+            total += row_hash(text)
+        return count, total % MOD
+
+    def psql_checksum(self, lo, hi) -> tuple[int, int]:
+        sql, params = self.where(lo, hi, "::uuid")
+        with self.psql().cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*), coalesce(sum(('x' || substr(md5("
+                f"{psql_row_text(self.headers)}), 1, 16))::bit(64)::bigint), 0) "
+                f"FROM {self.psql_table} {sql};",
+                params,
+            )
+            count, total = cursor.fetchone()
+        return count, int(total) % MOD
+
+    def drill_down(self, lo, hi) -> list[str]:
+        """Построчное сравнение одного чанка."""
+        lite = {row_id: row_hash(text) for row_id, text in self.lite_rows(lo, hi)}
+        sql, params = self.where(lo, hi, "::uuid")
+        with self.psql().cursor() as cursor:
+            cursor.execute(
+                f"SELECT id::text, {psql_row_text(self.headers)} "
+                f"FROM {self.psql_table} {sql};",
+                params,
+            )
+            psql = {row_id: row_hash(text) for row_id, text in cursor}
+        problems = [f"{self.table} {row_id}: missing" for row_id in lite.keys() - psql]
+        problems += [f"{self.table} {row_id}: extra" for row_id in psql.keys() - lite]
+        problems += [
+            f"{self.table} {row_id}: differs"
+            for row_id in lite.keys() & psql.keys()
+            if lite[row_id] != psql[row_id]
+        ]
+        return problems
+
+    def verify_chunk(self, bounds) -> list[str]:
+        if self.lite_checksum(*bounds) == self.psql_checksum(*bounds):
+            return []
+        return self.drill_down(*bounds)
+
+
+def verify_tables(
+    tables: list[tuple[str, object]],
+    sqlite_path: str,
+    psql_details: dict,
+    chunk_size: int = 10000,
+    workers: int = 4,
+) -> list[str]:
+    """Возвращает список расхождений; пустой, если данные совпали."""
+    problems = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for table, dto in tables:
+            verifier = TableVerifier(
+                table, dto, sqlite_path, psql_details, chunk_size
+            )
+            try:
+                chunks = verifier.chunks()
+                for chunk_problems in executor.map(verifier.verify_chunk, chunks):
+                    problems += chunk_problems
+            finally:
+                verifier.close()
+            print(f"{table}: {len(chunks)} chunks verified")
+    return problems
@@ -1,16 +1,16 @@
 import abc
-import json
-from datetime import date, datetime
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional
 from zoneinfo import ZoneInfo
 
+import serializers
+from config import settings
 from redis import Redis
 
 
-def get_default(obj):
-    if isinstance(obj, (date, datetime)):
-        return obj.isoformat()
-
-
 class BaseStorage(abc.ABC):
     @abc.abstractmethod
     def save_state(self, state: dict) -> None:
@@ -22,35 +22,208 @@ class BaseStorage(abc.ABC):
         """Загрузить состояние локально из постоянного хранилища"""
         pass
 
+    def flush(self) -> None:
+        """Записать отложенные изменения, если хранилище их копит"""
+        pass
+
+    def retrieve_all(self) -> dict:
+        """Все сохраненные ключи, для отладки"""
+        return {}
+
 
 class RedisStorage(BaseStorage):
     def __init__(self, redis_adapter: Redis):
         self.redis_adapter = redis_adapter
+        self.state_data = {}
+
+    def _load(self) -> dict:
         state_data = self.redis_adapter.get("data")
-        if state_data is None:
-            self.redis_adapter.set("data", "{}")
-            state_data = {}
-        else:
-            state_data = json.loads(state_data)
-        self.state_data = state_data
+        return {} if state_data is None else serializers.loads(state_data)
 
     def save_state(self, state: dict) -> None:
         """Я и хотел хранить в отдельном ключе, но меня сбили с толку тесты
             для задания со звездочкой, где FakeRedis проверял все в ключе
             data."""
-        self.state_data = json.loads(
-            (self.redis_adapter.get("data")).decode("utf-8")
-        )
+        self.state_data = self._load()
         self.state_data |= state
         self.redis_adapter.set(
-            "data", json.dumps(self.state_data, default=get_default)
+            "data", serializers.dumps(self.state_data)
         )
 
     def retrieve_state(self, key: str) -> dict:
-        state_data = json.loads(self.redis_adapter.get("data"))
+        state_data = self._load()
         ret = state_data.get(key, None)
         return ret
 
+    def retrieve_all(self) -> dict:
+        ret = {}
+        for key in self.redis_adapter.scan_iter():
+            ret[key] = self.redis_adapter.get(key)
+        return ret
+
+
+class RedisHashStorage(BaseStorage):
+    """Каждый ключ состояния хранится отдельным полем Redis-хэша.
+
+    Чтения идут из локального кэша, а записи копятся и уходят одним HSET
+    при flush, то есть на границе чекпоинта.
+    """
+
+    def __init__(self, redis_adapter: Redis, key: str = "state"):
+        self.redis_adapter = redis_adapter
+        self.key = key
+        self.cache = {}
+        self.pending = {}
+
+    def save_state(self, state: dict) -> None:
+        for key, value in state.items():
+            encoded = serializers.dumps(value)
+            self.pending[key] = encoded
+            # В кэше то же, что вернет Redis после записи.
+            self.cache[key] = serializers.loads(encoded)
+
+    def retrieve_state(self, key: str) -> any:
+        if key not in self.cache:
+            value = self.redis_adapter.hget(self.key, key)
+            self.cache[key] = None if value is None else serializers.loads(value)
+        return self.cache[key]
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        self.redis_adapter.hset(self.key, mapping=self.pending)
+        self.pending = {}
+
+    def retrieve_all(self) -> dict:
+        self.flush()
+        return self.redis_adapter.hgetall(self.key)
+
+
+class SQLiteStorage(BaseStorage):
+    """Состояние в локальной SQLite-базе в режиме WAL.
+
+    Подходит для одного узла: чекпоинт стоит микросекунды и не требует
+    внешнего сервиса. База открывается при первом обращении.
+    """
+
+    def __init__(self, path: str = "etl_state.sqlite3"):
+        self.path = path
+        self.cache = {}
+        self.pending = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def save_state(self, state: dict) -> None:
+        with self._lock:
+            for key, value in state.items():
+                encoded = serializers.dumps(value)
+                self.pending[key] = encoded
+                self.cache[key] = serializers.loads(encoded)
+
+    def retrieve_state(self, key: str) -> any:
+        with self._lock:
+            if key not in self.cache:
+                row = self.conn.execute(
+                    "SELECT value FROM state WHERE key = ?", (key,)
+                ).fetchone()
+                self.cache[key] = None if row is None else serializers.loads(row[0])
+            return self.cache[key]
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self.pending:
+                return
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO state (key, value) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    self.pending.items(),
+                )
+            self.pending = {}
+
+    def retrieve_all(self) -> dict:
+        self.flush()
+        return dict(self.conn.execute("SELECT key, value FROM state"))
+
+
+class JsonFileStorage(BaseStorage):
+    """Состояние в JSON-файле, который перезаписывается атомарно.
+
+    Новая версия пишется во временный файл, сбрасывается на диск через fsync
+    и подменяет старую через os.replace.
+    """
+
+    def __init__(self, path: str = "etl_state.json"):
+        self.path = path
+        self.state_data: Optional[dict] = None
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self.state_data is None:
+            try:
+                with open(self.path, "rb") as state_file:
+                    self.state_data = serializers.loads(state_file.read())
+            except FileNotFoundError:
+                self.state_data = {}
+        return self.state_data
+
+    def save_state(self, state: dict) -> None:
+        with self._lock:
+            encoded = serializers.dumps(state)
+            self._load().update(serializers.loads(encoded))
+            self.dirty = True
+
+    def retrieve_state(self, key: str) -> any:
+        with self._lock:
+            return self._load().get(key)
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self.dirty:
+                return
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as state_file:
+                state_file.write(serializers.dumps_bytes(self.state_data))
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            os.replace(tmp_path, self.path)
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            self.dirty = False
+
+    def retrieve_all(self) -> dict:
+        with self._lock:
+            return dict(self._load())
+
+
+def build_storage(kind: str, path: Optional[str] = None) -> BaseStorage:
+    """Хранилище состояния по настройке; ни к чему не подключается сразу."""
+    match kind:
+        case "redis":
+            return RedisStorage(Redis(host=settings.redis_host))
+        case "redis_hash":
+            return RedisHashStorage(Redis(host=settings.redis_host))
+        case "sqlite":
+            return SQLiteStorage(path) if path else SQLiteStorage()
+        case "json":
+            return JsonFileStorage(path) if path else JsonFileStorage()
+    raise ValueError(f"Unknown state storage: {kind}")
+
 
 class State:
     def __init__(self, storage: BaseStorage):
@@ -65,28 +238,23 @@ class State:
         state = self.storage.retrieve_state(key)
         return state
 
+    def flush(self) -> None:
+        """Сохранить накопленные изменения; вызывается на границе чекпоинта"""
+        self.storage.flush()
+
 
 def get_all_keys_and_values(state: State):
-    storage_adapter = state.storage.redis_adapter
-    ret = {}
-    for key in storage_adapter.scan_iter():
-        ret[key] = storage_adapter.get(key)
-    return ret
+    return state.storage.retrieve_all()
 
 
-def empty_state(state: State, keys: list[str]):
-    for key in keys:
-        state.set_state(key, None)
+def init_state(state: State):
+    """Начальные значения; вызывается при старте, а не при импорте."""
+    if state.get_state("time_of_run") is None:
+        state.set_state("time_of_run", datetime.now(zone))
+        state.flush()
 
 
 zone = ZoneInfo("Etc/GMT-3")
-storage = RedisStorage(Redis())
+storage = build_storage(settings.state_storage, settings.state_path)
 
 state = State(storage=storage)
-if state.get_state("time_of_run") is None:
-    state.set_state("time_of_run", datetime.now(zone))
-
-empty_state(
-    state,
-    ["film_work_excepted_ids", "person_excepted_ids", "genre_excepted_ids"],
-)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Модули ETL импортируются по имени, как при запуске из каталога etl.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,134 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from config import settings
+from elasticsearch.helpers import BulkIndexError
+from loader import ElasticAccessor
+
+
+class FakeBulkHandler(BaseHTTPRequestHandler):
+    """Эндпоинт _bulk, статусы документов задает тест через statuses."""
+
+    statuses = None
+    requests = []
+
+    def _reply(self, body: dict):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._reply({"version": {"number": "7.17.0", "build_flavor": "default"}})
+
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers["Content-Length"])).splitlines()
+        ids = [json.loads(line)["index"]["_id"] for line in lines[::2]]
+        attempt = len(self.requests)
+        self.requests.append(ids)
+        items = []
+        for doc_id in ids:
+            status = self.statuses(doc_id, attempt)
+            item = {"_id": doc_id, "status": status}
+            if status >= 300:
+                item["error"] = {"type": "error", "reason": str(status)}
+            items.append({"index": item})
+        self._reply({"took": 1, "errors": True, "items": items})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def accessor(monkeypatch):
+    monkeypatch.setattr(settings, "bulk_retry_sleep", 0)
+    monkeypatch.setattr(settings, "bulk_max_retries", 2)
+    monkeypatch.setattr(settings, "adaptive_batches", False)
+    FakeBulkHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBulkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    accessor = ElasticAccessor(
+        port=str(server.server_address[1]),
+        bulk_mode="streaming",
+        skip_unchanged=False,
+        check_index=False,
+    )
+    accessor.index_ready = True
+    yield accessor
+    server.shutdown()
+
+
+def make_actions(*ids):
+    return [{"_index": "movies", "_id": doc_id, "title": doc_id} for doc_id in ids]
+
+
+def test_retries_only_failed_documents(accessor):
+    FakeBulkHandler.statuses = staticmethod(
+        lambda doc_id, attempt: 429 if doc_id == "b" and attempt == 0 else 201
+    )
+    assert accessor.push_streaming(make_actions("a", "b", "c")) == (3, 0)
+    assert FakeBulkHandler.requests == [["a", "b", "c"], ["b"]]
+
+
+def test_raises_when_retries_exhausted(accessor):
+    FakeBulkHandler.statuses = staticmethod(
+        lambda doc_id, attempt: 429 if doc_id == "b" else 201
+    )
+    with pytest.raises(BulkIndexError) as error:
+        accessor.push_streaming(make_actions("a", "b"))
+    assert [next(iter(item.values()))["_id"] for item in error.value.errors] == ["b"]
+    assert FakeBulkHandler.requests == [["a", "b"], ["b"], ["b"]]
+
+
+def test_skips_permanent_rejects(accessor):
+    FakeBulkHandler.statuses = staticmethod(
+        lambda doc_id, attempt: 400 if doc_id == "b" else 201
+    )
+    assert accessor.push_streaming(make_actions("a", "b", "c")) == (2, 1)
+    assert FakeBulkHandler.requests == [["a", "b", "c"]]
+
+
+def test_parallel_chunk_latency_accounts_for_concurrency(accessor, monkeypatch):
+    monkeypatch.setattr(settings, "adaptive_batches", True)
+    monkeypatch.setattr(settings, "bulk_thread_count", 4)
+    observed = []
+    accessor.chunk_size = type(
+        "Controller",
+        (),
+        {"value": 100, "observe": lambda self, *args: observed.append(args)},
+    )()
+    accessor.bulk_mode = "parallel"
+    accessor.observe_chunks(seconds=2.0, sent=800, dumped=8000, throttled=0)
+    accessor.bulk_mode = "streaming"
+    accessor.observe_chunks(seconds=2.0, sent=800, dumped=8000, throttled=0)
+    assert observed == [(1.0, 1000, 0), (0.25, 1000, 0)]
+
+
+def test_chunk_bytes_count_utf8_payload(accessor, monkeypatch):
+    monkeypatch.setattr(settings, "adaptive_batches", True)
+    FakeBulkHandler.statuses = staticmethod(lambda doc_id, attempt: 201)
+    observed = []
+    accessor.chunk_size = type(
+        "Controller",
+        (),
+        {"value": 100, "observe": lambda self, *args: observed.append(args)},
+    )()
+    actions = [
+        {"_index": "movies", "_id": doc_id, "title": "Сталкер"}
+        for doc_id in ("a", "b")
+    ]
+    lines = []
+    for action in actions:
+        meta = {"index": {"_index": "movies", "_id": action["_id"]}}
+        lines += [meta, {"title": action["title"]}]
+    expected = sum(
+        len(json.dumps(line, ensure_ascii=False, separators=(",", ":")).encode())
+        for line in lines
+    )
+    assert accessor.push_streaming(actions) == (2, 0)
+    assert observed[0][1] == expected
@@ -0,0 +1,57 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Optional
+
+from loader import build_action
+from transformer import Transformer
+from utils import logger
+
+
+def transform_shard(rows: list[dict], index: str) -> list[dict]:
+    """Сворачивает строки и собирает bulk-документы внутри процесса."""
+    return [
+        build_action(filmwork, index)
+        for filmwork in Transformer(rows).transform_to_objects()
+    ]
+
+
+def shard_by_film(rows: list[dict], shards: int) -> list[list[dict]]:
+    """Все строки одного фильма попадают в один шард."""
+    parts = [[] for _ in range(shards)]
+    for row in rows:
+        parts[hash(row["id"]) % shards].append(row)
+    return [part for part in parts if part]
+
+
+class ProcessPoolTransformer:
+    """Трансформация больших пачек в пуле процессов.
+
+    Маленькие инкрементальные пачки обрабатываются в текущем процессе:
+    для них передача данных между процессами дороже самой работы.
+    """
+
+    def __init__(self, workers: int, min_rows: int, index: str = "movies"):
+        self.workers = workers
+        self.min_rows = min_rows
+        self.index = index
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def transform(self, rows: list[dict]) -> list[dict]:
+        if self.workers < 2 or len(rows) < self.min_rows:
+            return transform_shard(rows, self.index)
+        logger.info(f"Transforming {len(rows)} rows in {self.workers} processes")
+        actions = []
+        shards = shard_by_film(rows, self.workers)
+        for part in self.executor.map(transform_shard, shards, repeat(self.index)):
+            actions.extend(part)
+        return actions
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -7,67 +7,90 @@ class Transformer:
         self.raw_objects = raw_objects
 
     def transform_to_objects(self):
+        if self.raw_objects and "actors" in self.raw_objects[0]:
+            return self.transform_aggregated_to_objects()
         objects = {}
-        if self.raw_objects:
-            for filmwork in self.raw_objects:
-                if filmwork["id"] not in objects:
-                    objects[filmwork["id"]] = self.build_enrichedfw(filmwork)
-                else:
-                    self.add_info_to_filmwork(objects[filmwork["id"]], filmwork)
+        # Для каждого фильма: уже учтенные (роль, id персоны) и жанры.
+        seen = {}
+        for filmwork in self.raw_objects:
+            fw_id = filmwork["id"]
+            fw_object = objects.get(fw_id)
+            if fw_object is None:
+                fw_object = objects[fw_id] = self.build_enrichedfw(filmwork)
+                seen[fw_id] = set()
+            self.add_info_to_filmwork(fw_object, filmwork, seen[fw_id])
         self.objects = objects
         return list(self.objects.values())
 
-    def add_info_to_filmwork(self, fw_object: EnrichedFilmWork, filmwork: dict):
+    def transform_aggregated_to_objects(self):
+        """Строки агрегирующего запроса уже содержат по одному фильму."""
+        self.objects = {
+            filmwork["id"]: self.build_enrichedfw_from_aggregated(filmwork)
+            for filmwork in self.raw_objects
+        }
+        return list(self.objects.values())
+
+    def build_enrichedfw_from_aggregated(self, filmwork: dict) -> EnrichedFilmWork:
+        actors = [Person(p["id"], p["name"]) for p in filmwork["actors"]]
+        writers = [Person(p["id"], p["name"]) for p in filmwork["writers"]]
+        return EnrichedFilmWork(
+            id=filmwork["id"],
+            title=filmwork["title"],
+            description=filmwork["description"],
+            imdb_rating=filmwork["rating"],
+            type=filmwork["type"],
+            director=",".join(filmwork["directors"]),
+            created=filmwork["created"],
+            modified=filmwork["modified"],
+            actors=actors,
+            actors_names=[actor.name for actor in actors],
+            writers=writers,
+            writers_names=[writer.name for writer in writers],
+            genre=filmwork["genres"],
+        )
+
+    def add_info_to_filmwork(
+        self, fw_object: EnrichedFilmWork, filmwork: dict, seen: set
+    ):
+        person_id = filmwork["person_id"]
         role = filmwork["person_role"]
-        person_name = filmwork["person_name"]
-        person = Person(filmwork["person_id"], person_name)
-        match role:
-            case "actor":
-                if person not in fw_object.actors:
-                    fw_object.actors.append(person)
+        if person_id is not None and (role, person_id) not in seen:
+            seen.add((role, person_id))
+            person_name = filmwork["person_name"]
+            match role:
+                case "actor":
+                    fw_object.actors.append(Person(person_id, person_name))
                     fw_object.actors_names.append(person_name)
-            case "writer":
-                if person not in fw_object.writers:
-                    fw_object.writers.append(person)
+                case "writer":
+                    fw_object.writers.append(Person(person_id, person_name))
                     fw_object.writers_names.append(person_name)
-            case "director":
-                fw_object.director = person_name
+                case "director":
+                    fw_object.director = (
+                        f"{fw_object.director},{person_name}"
+                        if fw_object.director
+                        else person_name
+                    )
+        genre = filmwork["genre_name"]
+        if genre is not None and ("genre", genre) not in seen:
+            seen.add(("genre", genre))
+            fw_object.genre.append(genre)
 
     def build_enrichedfw(self, filmwork):
-        director = "director" if filmwork["person_role"] == "director" else ""
-        actors = (
-            [Person(filmwork["person_id"], filmwork["person_name"])]
-            if filmwork["person_role"] == "actor"
-            else []
-        )
-        actors_names = (
-            [filmwork["person_name"]] if filmwork["person_role"] == "actor" else []
-        )
-        writers = (
-            [Person(filmwork["person_id"], filmwork["person_name"])]
-            if filmwork["person_role"] == "writer"
-            else []
-        )
-        writers_names = (
-            [filmwork["person_name"]] if filmwork["person_role"] == "writer" else []
-        )
-
-        ret = EnrichedFilmWork(
+        return EnrichedFilmWork(
             id=filmwork["id"],
             title=filmwork["title"],
             description=filmwork["description"],
             imdb_rating=filmwork["rating"],
             type=filmwork["type"],
-            director=director,
+            director="",
             created=filmwork["created"],
             modified=filmwork["modified"],
-            actors=actors,
-            actors_names=actors_names,
-            writers=writers,
-            writers_names=writers_names,
-            genre=filmwork["genre_name"],
+            actors=[],
+            actors_names=[],
+            writers=[],
+            writers_names=[],
+            genre=[],
         )
-        return ret
 
     def transform_for_es(self):
         logger.info("Start transforming objects!")
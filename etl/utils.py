@@ -6,6 +6,8 @@ from time import sleep
 
 from psycopg2 import OperationalError
 
+import metrics
+
 ERROR_LOG_FILENAME = "logs.log"
 
 LOGGING_CONFIG = {
@@ -71,6 +73,7 @@ def backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
                     )
                 except Exception as e:
                     logger.error(e)
+                metrics.backoff_retries.inc(function=func.__name__)
                 sleep(sleep_time)
                 sleep_time = sleep_time * factor
                 if sleep_time > border_sleep_time:
@@ -100,6 +103,7 @@ def gen_backoff(start_sleep_time=0.1, factor=2, border_sleep_time=10):
                     logger.error(e)
                 else:
                     return ret
+                metrics.backoff_retries.inc(function=func.__name__)
                 sleep(sleep_time)
                 sleep_time = sleep_time * factor
                 if sleep_time > border_sleep_time: